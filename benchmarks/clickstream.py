@@ -0,0 +1,59 @@
+"""
+Synthetic clickstream shaped like the NASA fixtures (ip, date, url)
+
+Users walk a random site graph: every page links to `branching` other
+pages, followed with Zipf-like preference, and every user visits a Poisson
+number of pages around `events_per_user`.
+"""
+import numpy as np
+import pandas as pd
+
+
+def generate_clickstream(users=1000, events_per_user=10, vocab_size=200,
+                         branching=5, seed=0,
+                         start='1995-07-01 00:00:00'):
+    """
+    :param: users - number of distinct ips
+    :param: events_per_user - mean number of page views of a user
+    :param: vocab_size - number of distinct urls
+    :param: branching - links out of every page
+    :return: DataFrame with columns ip, date, url, sorted by date
+    """
+    rng = np.random.RandomState(seed)
+    links = rng.randint(vocab_size, size=(vocab_size, branching))
+    preference = 1. / np.arange(1, branching + 1)
+    preference /= preference.sum()
+    entry = 1. / np.arange(1, vocab_size + 1)
+    entry /= entry.sum()
+
+    lengths = np.maximum(rng.poisson(events_per_user, size=users), 1)
+    page = rng.choice(vocab_size, size=users, p=entry)
+    # every user arrives some time during a day, then clicks every minute
+    ts = rng.randint(0, 86400, size=users).astype(np.int64)
+
+    uid_steps = []
+    page_steps = []
+    ts_steps = []
+    active = np.arange(users)
+    for step in range(lengths.max()):
+        active = active[lengths[active] > step]
+        if step:
+            choice = rng.choice(branching, size=len(active), p=preference)
+            page[active] = links[page[active], choice]
+            ts[active] += rng.randint(1, 120, size=len(active))
+        uid_steps.append(active)
+        page_steps.append(page[active].copy())
+        ts_steps.append(ts[active].copy())
+
+    uid = np.concatenate(uid_steps)
+    df = pd.DataFrame({
+        'ip': pd.Index(['host{}.example.com'.format(i)
+                        for i in range(users)])[uid],
+        'date': pd.Timestamp(start) + pd.to_timedelta(
+            np.concatenate(ts_steps), unit='s'),
+        'url': pd.Index(['/page/{}.html'.format(i)
+                         for i in range(vocab_size)])[
+                             np.concatenate(page_steps)],
+    }, columns=['ip', 'date', 'url'])
+    df['date'] = df['date'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return df.sort_values('date', kind='mergesort').reset_index(drop=True)
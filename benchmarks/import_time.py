@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Benchmark the time to import graphitty modules in a fresh interpreter
+
+python benchmarks/import_time.py [--repeat 5] [module ...]
+
+Prints one JSON line per module with the best import time, and the heavy
+plotting / drawing modules it pulled in, which should be none.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = ['graphitty.graphitty', 'graphitty.funnel', 'graphitty.cache']
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'nxpd']
+
+SCRIPT = """
+import json, sys, time
+start = time.time()
+import {module}
+print(json.dumps({{
+    'seconds': time.time() - start,
+    'heavy_modules': [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module, repeat=5):
+    """ Best of `repeat` imports of `module`, each in a new interpreter
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=ROOT)
+        runs.append(json.loads(output.decode('utf-8').strip()))
+    return {
+        'module': module,
+        'seconds': min(r['seconds'] for r in runs),
+        'heavy_modules': runs[0]['heavy_modules'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for module in args.modules:
+        print(json.dumps(measure(module, repeat=args.repeat)))
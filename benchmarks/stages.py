@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Time and memory of every graphitty stage on synthetic clickstreams
+
+python benchmarks/stages.py --users 1000 10000 100000 --output report.json
+python benchmarks/stages.py --users 1000 10000 --compare report.json
+
+The report has one entry per stage and scale, with the wall time of an
+untraced run and the peak memory allocated during a second, traced run of
+the stage, and the scaling exponent of every stage (slope of log time over
+log users), which flags stages that grow faster than the input. --compare
+prints the stages slower than a previous report by more than --tolerance
+and exits with status 1.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.clickstream import generate_clickstream  # noqa: E402
+from graphitty.combiner import GraphCombiner  # noqa: E402
+from graphitty.funnel import Funnel  # noqa: E402
+from graphitty.graphitty import Graphitty  # noqa: E402
+
+STAGES = [
+    'build_path', 'render_graph', 'filter_subgraph', 'simplify',
+    'markov', 'funnel', 'extract_key_steps', 'combine',
+]
+
+
+def measure(func, memory=True):
+    """
+    Time `func` without tracing, then run it again under tracemalloc for
+    its peak memory, as tracing slows down allocations a lot
+
+    :return: (result of the timed run, seconds, peak bytes allocated or
+        None)
+    """
+    start = time.time()
+    result = func()
+    seconds = time.time() - start
+    peak = None
+    if memory and tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run_stages(users, events_per_user=10, vocab_size=200, branching=5,
+               seed=0, memory=True):
+    """ Run every stage on clickstreams of `users` users, once timed and
+    once traced for memory if `memory`
+
+    :return: list of {stage, users, seconds, peak_bytes}
+    """
+    params = dict(events_per_user=events_per_user, vocab_size=vocab_size,
+                  branching=branching)
+    df = generate_clickstream(users, seed=seed, **params)
+    df2 = generate_clickstream(users, seed=seed + 1, **params)
+    columns = dict(id_col='ip', behaviour_col='url', ts_col='date')
+
+    results = []
+    state = {}
+
+    def run(stage, func):
+        state[stage], seconds, peak = measure(func, memory=memory)
+        results.append({
+            'stage': stage,
+            'users': users,
+            'events': len(df),
+            'seconds': seconds,
+            'peak_bytes': peak,
+        })
+
+    run('build_path', lambda: Graphitty(df, **columns))
+    g = state['build_path']
+    run('render_graph', lambda: g.render_graph(filter_subgraph=False))
+    run('filter_subgraph', lambda: g.filter_subgraph(g.rendered_G.copy()))
+    run('simplify', g.simplify)
+    funnel_path = g.get_path_in_weight_order(max_path=1)[0]
+    run('markov', lambda: g.markov_chain().to_frame(funnel_path[-2]))
+    run('funnel', lambda: Funnel(funnel_path, g))
+    run('extract_key_steps', state['funnel'].extract_key_steps_from_df)
+    g2 = Graphitty(df2, **columns)
+    run('combine',
+        lambda: GraphCombiner(g, g2).get_simplifed_combine_graph())
+    return results
+
+
+def scaling(results):
+    """ Slope of log(seconds) over log(users) of each stage, between the
+    smallest and largest scale
+    """
+    exponents = {}
+    for stage in STAGES:
+        runs = sorted((r['users'], r['seconds']) for r in results
+                      if r['stage'] == stage and r['seconds'] > 0)
+        if len(runs) < 2 or runs[0][0] == runs[-1][0]:
+            continue
+        (u1, s1), (u2, s2) = runs[0], runs[-1]
+        exponents[stage] = math.log(s2 / s1) / math.log(float(u2) / u1)
+    return exponents
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(scales, memory=True, **params):
+    # load lazily imported modules before measuring
+    run_stages(100, memory=False, **params)
+    results = []
+    for users in scales:
+        results.extend(run_stages(users, memory=memory, **params))
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'params': params,
+        'results': results,
+        'scaling': scaling(results),
+    }
+
+
+def compare_reports(report, baseline, tolerance=0.5):
+    """
+    :return: list of (stage, users, seconds, baseline seconds) of stages
+        slower than the baseline by more than `tolerance`
+    """
+    before = {(r['stage'], r['users']): r['seconds']
+              for r in baseline['results']}
+    slower = []
+    for r in report['results']:
+        key = (r['stage'], r['users'])
+        if key in before and r['seconds'] > before[key] * (1 + tolerance):
+            slower.append((r['stage'], r['users'], r['seconds'],
+                           before[key]))
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, nargs='+',
+                        default=[1000, 10000])
+    parser.add_argument('--events-per-user', type=int, default=10)
+    parser.add_argument('--vocab-size', type=int, default=200)
+    parser.add_argument('--branching', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--compare', help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the traced run of every stage')
+    args = parser.parse_args()
+
+    report = build_report(args.users,
+                          memory=not args.no_memory,
+                          events_per_user=args.events_per_user,
+                          vocab_size=args.vocab_size,
+                          branching=args.branching,
+                          seed=args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare_reports(report, json.load(f),
+                                     tolerance=args.tolerance)
+        for stage, users, seconds, before in slower:
+            sys.stderr.write("{} at {} users: {:.3f}s, was {:.3f}s\n".format(
+                stage, users, seconds, before))
+        sys.exit(1 if slower else 0)
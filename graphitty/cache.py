@@ -0,0 +1,148 @@
+"""
+On-disk cache of built graphs
+
+Parsed paths and edge counts are stored as npz files, keyed by a fingerprint
+of the input together with the build parameters. Least recently used
+entries are evicted once the cache grows over `max_bytes`.
+"""
+import hashlib
+import json
+import os
+
+import six
+import numpy as np
+import pandas as pd
+
+from .paths import PathStore, EdgeTable
+
+
+class GraphCache(object):
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def fingerprint_file(path):
+        """ Fingerprint of a file from its path, mtime and size
+        """
+        stat = os.stat(path)
+        return _sha1("{}:{}:{}".format(
+            os.path.abspath(path), stat.st_mtime, stat.st_size))
+
+    @staticmethod
+    def fingerprint_frame(df):
+        """ Fingerprint of the content of a dataframe
+        """
+        h = hashlib.sha1()
+        h.update(json.dumps([str(c) for c in df.columns]).encode('utf-8'))
+        h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+        return h.hexdigest()
+
+    @staticmethod
+    def key(fingerprint, **params):
+        return _sha1(json.dumps([fingerprint, params], sort_keys=True,
+                                default=_to_json))
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key):
+        """
+        :return: dict of arrays, or None if not cached
+        """
+        path = self.path(key)
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as f:
+            entry = {k: f[k] for k in f.files}
+        # mark as recently used
+        os.utime(path, None)
+        return entry
+
+    def save(self, key, **arrays):
+        path = self.path(key)
+        tmp_path = os.path.join(self.directory, key + '.tmp.npz')
+        np.savez_compressed(tmp_path, **arrays)
+        os.rename(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """ Remove least recently used entries until under max_bytes
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz') or name.endswith('.tmp.npz'):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def load_graph(self, key):
+        """
+        :return: (PathStore or None, EdgeTable, extra arrays), or None if
+            not cached
+        """
+        entry = self.load(key)
+        if entry is None:
+            return None
+        paths = None
+        if 'path_offsets' in entry:
+            paths = PathStore(
+                pd.Index(entry.pop('path_user_ids')),
+                entry.pop('path_offsets'),
+                entry.pop('path_codes'),
+                entry.pop('path_vocab').astype(object))
+        edges = EdgeTable(entry.pop('edges'),
+                          entry.pop('edge_vocab').astype(object))
+        return paths, edges, entry
+
+    def save_graph(self, key, paths, edges, **extra):
+        arrays = dict(extra)
+        arrays['edges'] = edges.edges
+        arrays['edge_vocab'] = _to_array(edges.vocab)
+        if paths is not None:
+            arrays['path_user_ids'] = _to_array(paths.user_ids)
+            arrays['path_offsets'] = paths.offsets
+            arrays['path_codes'] = paths.codes
+            arrays['path_vocab'] = _to_array(paths.vocab)
+        self.save(key, **arrays)
+
+    @staticmethod
+    def encode_mapping(node_mapping):
+        return np.array(json.dumps(node_mapping, default=_to_json))
+
+    @staticmethod
+    def decode_mapping(array):
+        return {
+            dst: set(src_list)
+            for dst, src_list in json.loads(array.item()).items()
+        }
+
+
+def _sha1(s):
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+def _to_json(o):
+    if isinstance(o, (set, frozenset)):
+        return sorted(o)
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError("Cannot fingerprint {!r}".format(o))
+
+
+def _to_array(values):
+    """ Object arrays would need pickle, store them as unicode
+    """
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = values.astype(six.text_type)
+    return values
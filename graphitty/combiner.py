@@ -5,85 +5,157 @@ Combine multiple graphs into one
 * Compare edges using weight1, weight2
 """
 
+import numpy as np
+import pandas as pd
+
 from .graphitty import Graphitty
 from .comparator import Comparator
+from .instrument import namespace, stage
 
 
 class GraphCombiner(Graphitty):
-
-    def __init__(self, g1, g2,
-                 split_weight=False):
-        self.g1 = g1
-        self.g2 = g2
-        self.G = self.combine_graph(g1, g2, split_weight=split_weight)
-
-    def combine_graph(self,
-                      g1, g2,
-                      split_weight=False):
-        nx1 = g1.G
-        nx2 = g2.G
-        nx1.add_nodes_from(nx2)
-        # nx1.add_edges_from(nx2)
-        edge_data = {}
-        g1_edges = nx1.edges()
-        for n1, n2 in g1_edges:
-            weight = nx1.get_edge_data(n1, n2).get('weight', 0)
-            if split_weight:
-                nx1[n1][n2]['weight1'] = weight
-            else:
-                nx1[n1][n2]['weight'] = weight  # same thing
-
-        for n1, n2 in nx2.edges():
-            weight = nx2.get_edge_data(n1, n2).get('weight', 0)
-            if (n1, n2) in g1_edges:
-                if split_weight:
-                    nx1[n1][n2]['weight2'] = weight
-                else:
-                    nx1[n1][n2]['weight'] += weight
-            else:
-                if split_weight:
-                    nx1.add_edge(n1, n2,
-                                 weight2=weight)
-                else:
-                    nx1.add_edge(n1, n2,
-                                 weight=weight)
-
-        return nx1
+    """
+    Merge the edges of any number of graphs into one
+
+    GraphCombiner(g1, g2, ..., split_weight=False, instrumentation=None)
+
+    `weights` is the edge x graph table of weights, indexed by (src, dst)
+    with one column weight1 .. weightN per graph, 0 where a graph does not
+    have the edge. The input graphs are not modified.
+    """
+
+    def __init__(self, *graphs, **kwargs):
+        split_weight = kwargs.pop('split_weight', False)
+        instrumentation = kwargs.pop('instrumentation', None)
+        if kwargs:
+            raise TypeError("Unexpected arguments {}".format(sorted(kwargs)))
+        if not graphs:
+            raise ValueError("GraphCombiner needs at least one graph")
+        g = graphs[0]
+        if instrumentation is None:
+            instrumentation = g.instrumentation
+        Graphitty.__init__(self, None,
+                           id_col=g.id_col,
+                           behaviour_col=g.behaviour_col,
+                           ts_col=g.ts_col,
+                           init=False,
+                           instrumentation=instrumentation)
+        self.graphs = list(graphs)
+        self.split_weight = split_weight
+        with stage(instrumentation, 'combine_weights',
+                   graphs=len(graphs)) as record:
+            self.weights = self.combine_weights(graphs)
+            record['edges'] = len(self.weights)
+        self.comparison = None
+        with stage(instrumentation, 'combine_graph',
+                   edges=len(self.weights)):
+            self.G = self.combine_graph(graphs, self.weights,
+                                        split_weight=split_weight)
+
+    @property
+    def g1(self):
+        return self.graphs[0]
+
+    @property
+    def g2(self):
+        return self.graphs[1]
+
+    @staticmethod
+    def weight_columns(count):
+        return ['weight{}'.format(i + 1) for i in range(count)]
+
+    @classmethod
+    def combine_weights(cls, graphs):
+        """
+        Outer join the edge weights of all graphs on (src, dst)
+
+        :return: DataFrame of edges x graphs, edges in order of first
+            appearance
+        """
+        columns = []
+        for g in graphs:
+            edges = list(g.G.edges(data='weight', default=0))
+            columns.append(pd.Series(
+                [w for _, _, w in edges],
+                index=pd.MultiIndex.from_tuples(
+                    [(n1, n2) for n1, n2, _ in edges], names=['src', 'dst'])
+                if edges else pd.MultiIndex.from_arrays(
+                    [[], []], names=['src', 'dst']),
+                dtype=np.int64))
+        weights = pd.concat(columns, axis=1, join='outer', sort=False)
+        weights.columns = cls.weight_columns(len(graphs))
+        return weights.fillna(0).astype(np.int64)
+
+    @classmethod
+    def combine_graph(cls, graphs, weights, split_weight=False):
+        """
+        :return: new graph over the nodes of all graphs, with weight1 ..
+            weightN edge attributes (of the graphs having the edge) if
+            split_weight, or else the total weight
+        """
+        G = type(graphs[0].G)()
+        for g in graphs:
+            G.add_nodes_from(g.G)
+
+        srcs = weights.index.get_level_values(0)
+        dsts = weights.index.get_level_values(1)
+        if split_weight:
+            values = weights.values.tolist()
+            columns = list(weights.columns)
+            for n1, n2, row in zip(srcs, dsts, values):
+                G.add_edge(n1, n2, **{
+                    column: w for column, w in zip(columns, row) if w
+                })
+        else:
+            G.add_weighted_edges_from(
+                zip(srcs, dsts, weights.sum(axis=1).tolist()))
+        return G
 
     def remap_graph(self, g, name_mapping):
-        return Graphitty(
-            g.df,
-            id_col=g.id_col,
-            beahivour_col=g.behaviour_col,
-            ts_col=g.ts_col,
-            node_mapping=name_mapping)
+        return g.remap(name_mapping)
 
     def get_simplifed_combine_graph(self):
-        combine_g = GraphCombiner(self.g1, self.g2, split_weight=False)
-        name_mapping = combine_g.get_simplify_mapping()
-
-        g1_simplify = combine_g.remap_graph(self.g1, name_mapping)
-        g2_simplify = combine_g.remap_graph(self.g2, name_mapping)
+        instrumentation = self.instrumentation
+        with namespace(instrumentation, 'simplified_combine'):
+            combine_g = GraphCombiner(*self.graphs, split_weight=False,
+                                      instrumentation=instrumentation)
+            name_mapping = combine_g.get_simplify_mapping()
 
-        simplified_g = GraphCombiner(g1_simplify, g2_simplify,
-                                     split_weight=True)
-        simplified_g.do_compare()
+            simplified_g = GraphCombiner(*[
+                combine_g.remap_graph(g, name_mapping) for g in self.graphs
+            ], split_weight=True, instrumentation=instrumentation)
+            simplified_g.do_compare()
 
         return simplified_g
 
-    def do_compare(self):
-        # now execute comparison
-        G = self.G
-        total1 = self.g1.df[self.g1.id_col].nunique()
-        total2 = self.g2.df[self.g2.id_col].nunique()
-        for n1, n2 in G.edges():
-            eattr = G.get_edge_data(n1, n2)
-            G[n1][n2]['comparison'] = Comparator.compare_value(
-                eattr.get('weight1', 0),
-                eattr.get('weight2', 0),
-                total1=total1,
-                total2=total2
+    def do_compare(self, first=0, second=1, confidence=0.95):
+        """
+        Compare the weights of two of the graphs on every edge at once
+
+        comparison holds the rate difference and its significance per
+        edge, see Comparator.compare_significance. Edges of G get the
+        comparison and p_value attributes.
+        """
+        g1 = self.graphs[first]
+        g2 = self.graphs[second]
+        with stage(self.instrumentation, 'do_compare',
+                   edges=len(self.weights)):
+            comparison = Comparator.compare_significance(
+                self.weights.iloc[:, first].values,
+                self.weights.iloc[:, second].values,
+                total1=g1.user_count,
+                total2=g2.user_count,
+                confidence=confidence
             )
+            comparison.index = self.weights.index
+            self.comparison = comparison
+
+            G = self.G
+            for (n1, n2), c, p in zip(comparison.index,
+                                      comparison['compare'].tolist(),
+                                      comparison.p_value.tolist()):
+                G[n1][n2]['comparison'] = c
+                G[n1][n2]['p_value'] = p
 
     def render_graph(self, filter_subgraph=True):
 
@@ -1,5 +1,6 @@
 from __future__ import division
 
+import numpy as np
 import pandas as pd
 
 
@@ -9,8 +10,52 @@ class Comparator(object):
     def compare_value(v1, v2,
                       total1,
                       total2):
+        """ Difference of rates, works on scalars or whole arrays
+        """
         return v1 / total1 - v2 / total2
 
+    @staticmethod
+    def compare_significance(v1, v2,
+                             total1,
+                             total2,
+                             confidence=0.95):
+        """
+        Two-proportion z-test of v1 / total1 against v2 / total2, over whole
+        arrays of counts at once
+
+        :return: DataFrame with columns
+            * compare - difference of rates, as compare_value
+            * z, p_value - pooled two-sided z-test
+            * ci_low, ci_high - confidence interval of the difference
+        """
+        from scipy.stats import norm
+
+        v1 = np.asarray(v1, dtype=float)
+        v2 = np.asarray(v2, dtype=float)
+        rate1 = v1 / total1
+        rate2 = v2 / total2
+        compare = rate1 - rate2
+
+        pooled = np.clip((v1 + v2) / (total1 + total2), 0, 1)
+        se_pooled = np.sqrt(
+            pooled * (1 - pooled) * (1. / total1 + 1. / total2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.where(se_pooled > 0, compare / se_pooled, 0.)
+        p_value = 2 * norm.sf(np.abs(z))
+
+        rate1 = np.clip(rate1, 0, 1)
+        rate2 = np.clip(rate2, 0, 1)
+        se = np.sqrt(rate1 * (1 - rate1) / total1 +
+                     rate2 * (1 - rate2) / total2)
+        margin = norm.isf((1 - confidence) / 2.) * se
+        return pd.DataFrame({
+            'compare': compare,
+            'z': z,
+            'p_value': p_value,
+            'ci_low': compare - margin,
+            'ci_high': compare + margin,
+        }, columns=['compare', 'z', 'p_value', 'ci_low', 'ci_high'])
+
     @staticmethod
     def compare_list(df1, df2,
                      total1=None,
@@ -18,7 +63,12 @@ class Comparator(object):
                      count1='count',
                      count2='count',
                      threshold=0.20,
+                     confidence=0.95,
                      verbose=False):
+        """
+        :return: rows whose rates differ by more than threshold, most
+            different first, with the significance of each difference
+        """
         if total1 is None:
             total1 = len(df1)
         if total2 is None:
@@ -36,11 +86,19 @@ class Comparator(object):
             how='outer',
         ).fillna(0)
         assert len(joined) > 0
-        joined['compare'] = joined[count1 + 'l'] - joined[count2 + 'r']
+        significance = Comparator.compare_significance(
+            joined[count1 + 'l'].values * total1,
+            joined[count2 + 'r'].values * total2,
+            total1=total1,
+            total2=total2,
+            confidence=confidence)
+        significance.index = joined.index
+        joined = joined.join(significance)
 
-        seen_df = joined[
-            (joined.compare > threshold) | (joined.compare < -threshold)]
+        seen_df = joined[joined['compare'].abs() > threshold]
+        seen_df = seen_df.reindex(
+            seen_df['compare'].abs().sort_values(ascending=False).index)
 
         if verbose:
-            print joined
-        return joined
+            print(joined)
+        return seen_df
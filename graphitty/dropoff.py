@@ -0,0 +1,116 @@
+"""
+Dropoff statistics of the key steps of a funnel
+
+Statistics are computed for every step and label at once from the
+annotated dataframe of Funnel.extract_key_steps_from_df, and cached, so
+reports do not need any plotting library.
+"""
+import numpy as np
+import pandas as pd
+
+
+class DropoffStats(object):
+
+    def __init__(self, annotated_df, step_col='step_count'):
+        self.df = annotated_df
+        self.step_col = step_col
+        self._cache = {}
+
+    def __cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def histogram(self, metric, label='is_last_step', bins=10, xmin=0,
+                  xmax=None):
+        """
+        Histogram of `metric` for each step and label, binned as
+        numpy.histogram over [xmin, xmax]
+
+        :param: xmax - defaults to the max of the metric in each step
+        :return: (counts, bin_edges) - counts is indexed by (step, label)
+            with one column per bin, bin_edges is indexed by step
+        """
+        return self.__cached(
+            ('histogram', metric, label, bins, xmin, xmax),
+            lambda: self.__histogram(metric, label, bins, xmin, xmax))
+
+    def __histogram(self, metric, label, bins, xmin, xmax):
+        df = self.df[[self.step_col, label, metric]].dropna(subset=[metric])
+        step = df[self.step_col].values
+        values = df[metric].values.astype(float)
+
+        steps, step_idx = np.unique(step, return_inverse=True)
+        if xmax is None:
+            step_max = np.full(len(steps), -np.inf)
+            np.maximum.at(step_max, step_idx, values)
+        else:
+            step_max = np.full(len(steps), float(xmax))
+        step_max = np.maximum(step_max, xmin)
+        # numpy widens an empty range to +-0.5
+        empty = step_max == xmin
+        lo = np.where(empty, xmin - 0.5, xmin)
+        hi = np.where(empty, xmin + 0.5, step_max)
+        bin_edges = lo[:, None] + (hi - lo)[:, None] * np.linspace(
+            0, 1, bins + 1)[None, :]
+
+        lo = lo[step_idx]
+        hi = hi[step_idx]
+        in_range = (values >= lo) & (values <= hi)
+        bin_idx = np.floor((values - lo) / (hi - lo) * bins).astype(int)
+        # the last bin includes its right edge
+        bin_idx = np.minimum(bin_idx, bins - 1)
+
+        counts = pd.DataFrame({
+            'step': step[in_range],
+            'label': df[label].values[in_range],
+            'bin': bin_idx[in_range],
+        }).groupby(['step', 'label', 'bin']).size().unstack(
+            'bin', fill_value=0).reindex(columns=range(bins), fill_value=0)
+        counts.index.names = [self.step_col, label]
+        counts.columns.name = None
+        return counts, pd.DataFrame(
+            bin_edges, index=pd.Index(steps, name=self.step_col))
+
+    def quantiles(self, metric, label='is_last_step', q=(.25, .5, .75)):
+        """
+        :return: dataframe indexed by (step, label), one column per quantile
+        """
+        def compute():
+            return self.df.groupby([self.step_col, label])[metric].quantile(
+                list(q)).unstack()
+        return self.__cached(('quantiles', metric, label, tuple(q)), compute)
+
+    def correlation(self, metric, label='is_last_step'):
+        """
+        Pearson correlation and least squares fit of `metric` on `label`
+        within each step
+
+        :return: dataframe indexed by step with columns count, correlation,
+            slope and intercept
+        """
+        return self.__cached(('correlation', metric, label),
+                             lambda: self.__correlation(metric, label))
+
+    def __correlation(self, metric, label):
+        df = self.df[[self.step_col, label, metric]].dropna()
+        x = df[label].values.astype(float)
+        y = df[metric].values.astype(float)
+        sums = pd.DataFrame({
+            'n': np.ones(len(x)), 'x': x, 'y': y,
+            'xx': x * x, 'yy': y * y, 'xy': x * y,
+        }).groupby(df[self.step_col].values).sum()
+        n = sums['n']
+        sxx = n * sums['xx'] - sums['x'] ** 2
+        syy = n * sums['yy'] - sums['y'] ** 2
+        sxy = n * sums['xy'] - sums['x'] * sums['y']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = sxy / sxx
+            stats = pd.DataFrame({
+                'count': n.astype(int),
+                'correlation': sxy / np.sqrt(sxx * syy),
+                'slope': slope,
+                'intercept': (sums['y'] - slope * sums['x']) / n,
+            }, columns=['count', 'correlation', 'slope', 'intercept'])
+        stats.index.name = self.step_col
+        return stats
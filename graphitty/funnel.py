@@ -1,8 +1,13 @@
-import random
+import numbers
+
+import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-from collections import defaultdict
+
+from .dropoff import DropoffStats
+from .instrument import stage
+from .paths import (
+    common_prefix_lengths, funnel_steps_matrix, hash_sample,
+    match_funnel_steps, user_hash)
 
 
 class Funnel(object):
@@ -10,10 +15,24 @@ class Funnel(object):
     Simulate the funnel of each step across the graph
     """
 
-    def __init__(self, path, graph):
+    def __init__(self, path, graph, max_steps=None, instrumentation=None):
+        """
+        :param: max_steps - steps reached by each user of graph.paths, if
+            already computed e.g. by build_funnels
+        :param: instrumentation - defaults to the one of the graph
+        """
         self.funnel_path = path
         self.graph = graph
-        self.user_max_steps = {}
+        if instrumentation is None:
+            instrumentation = getattr(graph, 'instrumentation', None)
+        self.instrumentation = instrumentation
+        # per user of graph.paths, how far the user got in the funnel
+        self.user_ids = None
+        self.max_steps = None
+        self.in_funnel = None
+        self._user_max_steps = None
+        self._steps = None
+        self._dropoff_stats = None
 
         # tranfer parameters from graph
         self.df = graph.df
@@ -21,7 +40,10 @@ class Funnel(object):
         self.behaviour_col = graph.behaviour_col
         self.ts_col = graph.ts_col
 
-        self.steps = self.identify_user_steps(path, graph)
+        with stage(self.instrumentation, 'funnel_steps',
+                   steps=len(path)) as record:
+            self.identify_user_steps(path, graph, max_steps=max_steps)
+            record['users'] = len(self.user_ids)
         self.annotated_df = None
 
     def is_common_path(self, user_path, funnel_path=None):
@@ -41,17 +63,53 @@ class Funnel(object):
                 user_idx += 1
         return common_path
 
-    def identify_user_steps(self, funnel_path, graph):
-        steps = [
-            {'name': s, 'user': []}
-            for s in funnel_path
-        ]
-        for user_id, path in graph.path_aggregate_df.iterrows():
-            common_path = self.is_common_path(path.path)
-            for i, p in enumerate(common_path):
-                steps[i]['user'].append(user_id)
-            self.user_max_steps[user_id] = len(common_path)
-        return steps
+    def identify_user_steps(self, funnel_path, graph, max_steps=None):
+        """
+        Match all user paths against the funnel at once
+
+        :return: list of steps, 'user' is the sorted array of indices (into
+            self.user_ids) of users who reached the step
+        """
+        if graph.paths is None:
+            raise ValueError("Funnel needs a graph with user paths")
+        self.user_ids = graph.paths.user_ids
+        if max_steps is None:
+            max_steps = common_prefix_lengths(graph.paths, funnel_path)
+        self.max_steps = np.array(max_steps, dtype=np.int32)
+        self.in_funnel = np.ones(len(self.max_steps), dtype=bool)
+        self._user_max_steps = None
+        self._steps = None
+        return self.steps
+
+    @property
+    def steps(self):
+        """ Users who reached each step, built from the in_funnel mask
+        """
+        if self._steps is None:
+            self._steps = [
+                {'name': s, 'user': np.flatnonzero(
+                    self.in_funnel & (self.max_steps > i))}
+                for i, s in enumerate(self.funnel_path)
+            ]
+        return self._steps
+
+    @property
+    def user_max_steps(self):
+        """ Dict of user id -> steps reached, for users in the funnel
+        """
+        if self._user_max_steps is None:
+            self._user_max_steps = dict(zip(
+                self.user_ids[self.in_funnel],
+                self.max_steps[self.in_funnel].tolist()))
+        return self._user_max_steps
+
+    @property
+    def stats(self):
+        """ Records of the instrumented stages, see graphitty.instrument
+        """
+        if self.instrumentation is None:
+            return {}
+        return self.instrumentation.stats
 
     def describe_steps(self):
         self.funnel_df = pd.DataFrame({
@@ -64,23 +122,101 @@ class Funnel(object):
         return self.funnel_df
 
     def remove_user(self, user_id):
-        if user_id not in self.user_max_steps:
+        idx = self.user_ids.get_indexer([user_id])[0]
+        if idx < 0 or not self.in_funnel[idx]:
             raise KeyError("User {} not in funnel".format(user_id))
-        max_steps = self.user_max_steps[user_id]
-        del self.user_max_steps[user_id]
-        for s in self.steps[:max_steps]:
-            s['user'].remove(user_id)
+        self.in_funnel[idx] = False
+        if self._user_max_steps is not None:
+            del self._user_max_steps[user_id]
+        self._steps = None
 
-    def filter_df_by_users(self, df=None, id_col=None, sample=None):
+    def remove_users(self, mask):
+        """
+        :param: mask - boolean array over self.user_ids of users to remove,
+            users already removed are ignored
+        """
+        self.in_funnel &= ~mask
+        self._user_max_steps = None
+        self._steps = None
+
+    @staticmethod
+    def _is_fraction(sample):
+        """ True if `sample` is a fraction of users, False if a count
+        """
+        if isinstance(sample, numbers.Integral) and \
+                not isinstance(sample, bool):
+            if sample < 0:
+                raise ValueError(
+                    "sample must be a positive count, got {}".format(sample))
+            return False
+        if isinstance(sample, numbers.Real) and 0 < sample <= 1:
+            return True
+        raise ValueError(
+            "sample must be an integer count or a fraction in (0, 1], "
+            "got {!r}".format(sample))
+
+    def sample_users(self, sample=None, seed=0):
+        """
+        Users in the funnel, sampled by hashing their id with `seed`
+
+        :param: sample - integer number of users, or float fraction of users
+            in (0, 1]
+        :return: boolean array over self.user_ids
+        """
+        if not sample:
+            return self.in_funnel.copy()
+        if self._is_fraction(sample):
+            return self.in_funnel & hash_sample(
+                self.user_ids, sample, seed=seed)
+
+        idx = np.flatnonzero(self.in_funnel)
+        if sample > len(idx):
+            raise ValueError(
+                "Cannot sample {} users out of {} in the funnel".format(
+                    sample, len(idx)))
+        if sample < len(idx):
+            # users with the smallest hashes
+            h = user_hash(self.user_ids[idx], seed=seed)
+            idx = idx[np.argpartition(h, sample - 1)[:sample]]
+        mask = np.zeros(len(self.user_ids), dtype=bool)
+        mask[idx] = True
+        return mask
+
+    def filter_df_by_users(self, df=None, id_col=None, sample=None, seed=0):
+        """
+        :param: sample - see sample_users, the same users are sampled for
+            the same seed
+        """
         if df is None:
             df = self.df
         if id_col is None:
             id_col = self.id_col
-        user_in_funnel = self.user_max_steps.keys()
-        if sample:
-            user_in_funnel = random.sample(user_in_funnel, k=sample)
+        user_in_funnel = self.user_ids[self.sample_users(sample, seed=seed)]
         return df[df[id_col].isin(user_in_funnel)]
 
+    def filter_chunks_by_users(self, chunks, id_col=None, sample=None,
+                               seed=0):
+        """
+        Same as filter_df_by_users over chunks, e.g.
+        pd.read_csv(..., chunksize=...), so only the kept rows of each chunk
+        stay in memory. A fraction `sample` is decided by hashing the ids of
+        each chunk, before looking them up.
+        """
+        if id_col is None:
+            id_col = self.id_col
+        fraction = bool(sample) and self._is_fraction(sample)
+        if fraction:
+            user_in_funnel = self.in_funnel
+        else:
+            user_in_funnel = self.sample_users(sample, seed=seed)
+        for chunk in chunks:
+            if fraction:
+                chunk = chunk[hash_sample(chunk[id_col], sample, seed=seed)]
+            uid = self.user_ids.get_indexer(chunk[id_col])
+            keep = uid >= 0
+            keep[keep] = user_in_funnel[uid[keep]]
+            yield chunk[keep]
+
     @property
     def funnel_path_in_df(self):
         # These are nodes which is added manually
@@ -90,59 +226,92 @@ class Funnel(object):
         ]
         return funnel_path
 
-    def __label_group(self, group, include_intermediate=False):
+    def __label_rows(self, df, id_col, state):
         """
-        Internal function for parsing path.
-        Identify steps that are in those steps and then return those.
+        Keep the rows at which users progress in the funnel, adding
+        `step_count`. A user at the end of the funnel progresses to 'exit'.
 
-        Used in pandas.apply
-        Adding two columns:
-        * last_step (yes / no)
-        * step_count
+        :return: (kept rows, index into self.user_ids of each kept row)
         """
-        funnel_path = self.funnel_path_in_df
+        uid = self.user_ids.get_indexer(df[id_col])
+        in_funnel = uid >= 0
+        in_funnel[in_funnel] = self.in_funnel[uid[in_funnel]]
+        df = df[in_funnel]
+        uid = uid[in_funnel]
 
-        path_idx = 0
-        sorted_time = group.sort_values(self.ts_col)
-        wanted_steps = []
-        for _, row in sorted_time.iterrows():
-            # Identify what step the user is at
-            path_name = funnel_path[path_idx] if path_idx < len(
-                funnel_path) else 'exit'
-            current_name = row[self.behaviour_col]
-            if path_name == current_name:
-                path_idx += 1
-                # check if user is at last step:
-                user_id = row[self.id_col]
-                max_step = self.user_max_steps[user_id]
-                row['step_count'] = path_idx
-                wanted_steps.append(row)
-            else:
-                if include_intermediate:
-                    row['step_count'] = path_idx
-                    wanted_steps.append(row)
-
-        if not wanted_steps:
-            return None
-        return_df = pd.DataFrame(wanted_steps)
-        return_df['is_last_step'] = (return_df['step_count'] == path_idx)
-        return return_df
+        order = pd.DataFrame({
+            'uid': uid, 'ts': df[self.ts_col].values,
+        }).sort_values(['uid', 'ts'], kind='mergesort').index.values
+        df = df.iloc[order]
+        uid = uid[order]
+        step_count = match_funnel_steps(
+            uid, df[self.behaviour_col].values,
+            self.funnel_path_in_df + ['exit'], state)
+        matched = step_count > 0
+        df = df[matched].copy()
+        df['step_count'] = step_count[matched]
+        return df, uid[matched]
 
-    def extract_key_steps_from_df(self, df=None, id_col=None, sample=None):
+    def extract_key_steps_from_df(self, df=None, id_col=None, sample=None,
+                                  seed=0):
         """ Given a trail dataframe, extract the key steps
+
+        Adding two columns:
+        * step_count
+        * is_last_step (yes / no)
         """
         if df is None:
             df = self.df
         if id_col is None:
             id_col = self.id_col
 
-        filter_df = self.filter_df_by_users(df, sample=sample)
+        with stage(self.instrumentation, 'extract_key_steps',
+                   rows=len(df)) as record:
+            filter_df = self.filter_df_by_users(
+                df, id_col=id_col, sample=sample, seed=seed)
+            state = np.zeros(len(self.user_ids), dtype=np.int64)
+            annotated_df, uid = self.__label_rows(filter_df, id_col, state)
+            annotated_df['is_last_step'] = (
+                annotated_df['step_count'].values == state[uid])
+            annotated_df = annotated_df.reset_index(drop=True)
+            record['kept_rows'] = len(annotated_df)
+        self.annotated_df = annotated_df
+        return annotated_df
 
-        annotated_df = pd.DataFrame(
-            filter_df.groupby(id_col).apply(
-                self.__label_group
-            )
-        ).reset_index(drop=True)
+    def extract_key_steps_from_chunks(self, chunks, id_col=None, sample=None,
+                                      seed=0):
+        """ Same as extract_key_steps_from_df, reading the trail in chunks
+
+        Only the rows at which users progress are kept in memory.
+
+        :param: chunks - iterable of dataframes in `ts_col` order, e.g.
+            pd.read_csv(..., chunksize=...)
+        """
+        if id_col is None:
+            id_col = self.id_col
+
+        with stage(self.instrumentation, 'extract_key_steps',
+                   chunks=0) as record:
+            state = np.zeros(len(self.user_ids), dtype=np.int64)
+            frames = []
+            uids = []
+            chunks = self.filter_chunks_by_users(
+                chunks, id_col=id_col, sample=sample, seed=seed)
+            for chunk in chunks:
+                df, uid = self.__label_rows(chunk, id_col, state)
+                frames.append(df)
+                uids.append(uid)
+                record['chunks'] += 1
+            if not frames:
+                raise ValueError("No chunks to extract key steps from")
+
+            uid = np.concatenate(uids)
+            order = np.argsort(uid, kind='mergesort')
+            annotated_df = pd.concat(frames).iloc[order]
+            annotated_df['is_last_step'] = (
+                annotated_df['step_count'].values == state[uid[order]])
+            annotated_df = annotated_df.reset_index(drop=True)
+            record['kept_rows'] = len(annotated_df)
         self.annotated_df = annotated_df
         return annotated_df
 
@@ -163,21 +332,36 @@ class Funnel(object):
                 raise KeyError(
                     "kind must be one of 'histogram' or 'correlation'")
 
+    @property
+    def dropoff_stats(self):
+        """ Cached DropoffStats of annotated_df
+        """
+        if self.annotated_df is None:
+            raise ValueError("Call extract_key_steps_from_df first")
+        if self._dropoff_stats is None or \
+                self._dropoff_stats.df is not self.annotated_df:
+            self._dropoff_stats = DropoffStats(self.annotated_df)
+        return self._dropoff_stats
+
     def visualize_step_dropoff_correlation(self, step_count, metric,
                                            label='is_last_step', title=None):
         funnel_path = self.funnel_path_in_df
         step_name = funnel_path[step_count]
+        if title is None:
+            correlation = self.dropoff_stats.correlation(
+                metric, label=label).correlation.get(step_count + 1, np.nan)
+            title = 'Step {}: comparing {} to dropoff ratio (r={:.2f})'.format(
+                step_name, metric, correlation)
+
+        import seaborn as sns
 
         df = self.annotated_df
         step_df = df[df.step_count == step_count+1]
         sns.jointplot(
-            step_df['is_last_step'],
-            step_df[metric],
+            x=step_df[label].astype(float),
+            y=step_df[metric],
             kind='reg'
-        ).fig.suptitle(
-            'Step {}: comparing {} to dropoff ratio'.format(
-                step_name, metric
-            ))
+        ).fig.suptitle(title)
 
     def visualize_step_dropoff_histogram(self, step_count, metric,
                                          label='is_last_step',
@@ -185,30 +369,45 @@ class Funnel(object):
                                          title=None):
         """Visualize histogram of distribution of dropoff metrics
         """
+        import matplotlib.pyplot as plt
+
         funnel_path = self.funnel_path_in_df
         step_name = funnel_path[step_count]
         if title is None:
             title = 'Step {}: comparing {} to dropoff ratio'.format(
                     step_name, metric
             )
-        df = self.annotated_df
-        df = df[df.step_count == step_count+1]
-        label_classes = sorted(df[label].unique())
-        series = [
-            df[df[label] == v][metric].dropna()
-            for v in label_classes
-        ]
-        if xmax is None:
-            xmax = df[metric].max()
+        counts, bin_edges = self.dropoff_stats.histogram(
+            metric, label=label, bins=bins, xmin=xmin, xmax=xmax)
+        counts = counts.loc[step_count+1]
+        bin_edges = bin_edges.loc[step_count+1].values
 
-        plt.hist(series, range=[xmin, xmax], bins=bins, label=[
-            "{}={}".format(label, c) for c in label_classes
-        ])
+        # draw the precomputed counts as weights of the bin edges
+        plt.hist([bin_edges[:-1]] * len(counts), bins=bin_edges,
+                 weights=list(counts.values), label=[
+                     "{}={}".format(label, c) for c in counts.index
+                 ])
         plt.title(title)
         plt.legend(loc='upper right')
         plt.show()
 
 
+def build_funnels(funnel_paths, graph):
+    """
+    Create a Funnel for each path, matching user paths against all of them
+    in a single pass
+
+    e.g. build_funnels(g.get_path_in_weight_order(max_path=20), g)
+    """
+    with stage(getattr(graph, 'instrumentation', None),
+               'funnel_steps_matrix', funnels=len(funnel_paths)):
+        matrix = funnel_steps_matrix(graph.paths, funnel_paths)
+    return [
+        Funnel(path, graph, max_steps=matrix[:, i])
+        for i, path in enumerate(funnel_paths)
+    ]
+
+
 class FunnelCombination(object):
     """ This class consider multiple funnel, and remove user who have progressed
     further in other funnel.
@@ -223,21 +422,55 @@ class FunnelCombination(object):
 
     def __init__(self, funnels):
         self.funnels = funnels
-        user_max_steps = defaultdict(int)
-
-        # identify max steps from user
-        for f in funnels:
-            for user, max_steps in f.user_max_steps.items():
-                if user_max_steps[user] < max_steps:
-                    user_max_steps[user] = max_steps
+        # users x funnels, -1 where the user is not in the funnel
+        self.user_index, positions, matrix = self.__steps_matrix(funnels)
+        self._user_max_steps = None
+        if not funnels:
+            self.max_steps = np.empty(0, dtype=np.int32)
+            self.best_funnel = np.empty(0, dtype=np.int64)
+            return
+        self.max_steps = matrix.max(axis=1)
+        # first funnel in which the user got the furthest
+        self.best_funnel = matrix.argmax(axis=1)
 
         # remove user that is not suitable
-        for user, combine_max_steps in user_max_steps.items():
-            for f in funnels:
-                max_steps = f.user_max_steps[user]
-                if combine_max_steps > max_steps:
-                    f.remove_user(user)
-        self.user_max_steps = user_max_steps
+        worse = matrix < self.max_steps[:, None]
+        for i, f in enumerate(funnels):
+            f.remove_users(worse[positions[i], i])
+
+    @staticmethod
+    def __steps_matrix(funnels):
+        """ Align the steps reached in each funnel over one user index
+        """
+        user_index = funnels[0].user_ids if funnels else pd.Index([])
+        for f in funnels[1:]:
+            if not f.user_ids.equals(user_index):
+                user_index = user_index.union(f.user_ids)
+
+        positions = []
+        matrix = np.full((len(user_index), len(funnels)), -1, dtype=np.int32)
+        for i, f in enumerate(funnels):
+            if f.user_ids.equals(user_index):
+                pos = np.arange(len(user_index))
+            else:
+                pos = user_index.get_indexer(f.user_ids)
+            matrix[pos[f.in_funnel], i] = f.max_steps[f.in_funnel]
+            positions.append(pos)
+        return user_index, positions, matrix
+
+    @property
+    def user_max_steps(self):
+        """ Dict of user id -> furthest step reached in any funnel
+        """
+        if self._user_max_steps is None:
+            valid = self.max_steps >= 0
+            self._user_max_steps = dict(zip(
+                self.user_index[valid], self.max_steps[valid].tolist()))
+        return self._user_max_steps
+
+    @classmethod
+    def from_paths(cls, funnel_paths, graph):
+        return cls(build_funnels(funnel_paths, graph))
 
     @property
     def user_ids(self):
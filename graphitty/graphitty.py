@@ -2,11 +2,23 @@ import six
 
 import math
 import re
+from bisect import bisect_left
 from collections import Counter, defaultdict
+from itertools import islice
 
 import networkx as nx
+import numpy as np
 import pandas as pd
 
+from .instrument import namespace, stage
+from .markov import MarkovChain
+from .transitions import TransitionMatrix, edge_weight
+from .paths import (
+    EXIT, PathStore, EdgeTable, StreamingPathBuilder,
+    build_paths, clean_behaviour, extract_paths_parallel, extend_paths,
+    merge_paths, count_edges, sort_events
+)
+
 
 class Graphitty(object):
     """
@@ -22,31 +34,444 @@ class Graphitty(object):
                  node_mapping=None,
                  skip_backref=True,
                  max_edges=200,
-                 min_edges=0
+                 min_edges=0,
+                 workers=1,
+                 cache=None,
+                 fingerprint=None,
+                 instrumentation=None
                  ):
+        """
+        :param: instrumentation [Instrumentation] Record time, memory and
+            counters of every stage, see graphitty.instrument
+        """
         self.df = df
         self.behaviour_col = behaviour_col
         self.id_col = id_col
         self.ts_col = ts_col
-        self.G = None
+        self.workers = workers
+        self.instrumentation = instrumentation
+        self._G = None
+        self._transitions = None
+        self._node_index = None
         self.rendered_G = None
         self.add_edge_callback = None
-        self.path_aggregate_df = None
+        self.paths = None
+        # (paths, path_aggregate_df built from them)
+        self._path_aggregate = (None, None)
+        self.edges = None
+        self.cache = None
+        self.cache_key = None
+        self._user_count = None
+        self.node_mapping = node_mapping
+        self.skip_backref = skip_backref
+        self.max_edges = max_edges
+        self.min_edges = min_edges
+        # events that can still be reordered by update()
+        self._set_update_state()
 
         if init:
             self.build_path(node_mapping=node_mapping,
                             skip_backref=skip_backref,
                             min_edges=min_edges,
-                            max_edges=max_edges)
-            assert len(self.G.nodes()) > 0
+                            max_edges=max_edges,
+                            workers=workers,
+                            cache=cache,
+                            fingerprint=fingerprint)
+            assert len(self.transitions) > 0
 
     def build_path(self,
                    node_mapping=None,
                    skip_backref=True,
                    max_edges=200,
-                   min_edges=0):
+                   min_edges=0,
+                   workers=1,
+                   cache=None,
+                   fingerprint=None):
         """
         Parse dataframe into Network X edges
+
+        :param: workers [int] Number of processes to extract user paths
+            with, users are sharded by id_col
+        :param: cache [GraphCache] Reuse paths and edges built before from
+            the same input and parameters
+        :param: fingerprint [str] Fingerprint of the input for the cache,
+            e.g. GraphCache.fingerprint_file(csv), defaults to hashing df
+        :return: path_aggregate_df, the path of each user
+        """
+        params = dict(node_mapping=node_mapping,
+                      skip_backref=skip_backref,
+                      min_edges=min_edges,
+                      max_edges=max_edges)
+        if cache is not None:
+            if fingerprint is None:
+                fingerprint = cache.fingerprint_frame(self.df)
+            if self.__load_cache(cache, fingerprint, **params):
+                return self.path_aggregate_df
+
+        instrumentation = self.instrumentation
+        if type(self).get_template_path is not Graphitty.get_template_path:
+            # customized path generation, need to walk each user
+            with stage(instrumentation, 'extract_paths',
+                       rows=len(self.df)) as record:
+                edge_count, path_aggregate = self.__build_path_by_group(
+                    node_mapping=node_mapping)
+                paths = PathStore.from_lists(path_aggregate.index,
+                                             list(path_aggregate.path))
+                edges = EdgeTable.from_counter(edge_count)
+                record['users'] = len(paths)
+                record['edges'] = len(edges)
+        elif workers > 1:
+            # events are sorted within the workers
+            with stage(instrumentation, 'extract_paths',
+                       rows=len(self.df), workers=workers) as record:
+                paths = extract_paths_parallel(
+                    self.df, self.id_col, self.behaviour_col,
+                    self.ts_col, workers=workers)
+                record['users'] = len(paths)
+                record['path_nodes'] = len(paths.codes)
+            with stage(instrumentation, 'count_edges') as record:
+                edges = count_edges(paths, node_mapping=node_mapping)
+                record['edges'] = len(edges)
+        else:
+            with stage(instrumentation, 'sort',
+                       rows=len(self.df)) as record:
+                events = sort_events(self.df, self.id_col,
+                                     self.behaviour_col, self.ts_col)
+                record['events'] = len(events[1])
+            with stage(instrumentation, 'extract_paths',
+                       rows=len(self.df), workers=workers) as record:
+                paths = build_paths(*events)
+                record['users'] = len(paths)
+                record['path_nodes'] = len(paths.codes)
+            with stage(instrumentation, 'count_edges') as record:
+                edges = count_edges(paths, node_mapping=node_mapping)
+                record['edges'] = len(edges)
+
+        self._set_edges(paths, edges,
+                        node_mapping=node_mapping,
+                        skip_backref=skip_backref,
+                        min_edges=min_edges,
+                        max_edges=max_edges)
+        if cache is not None:
+            cache.save_graph(self.cache_key, paths, edges)
+        return self.path_aggregate_df
+
+    def __load_cache(self, cache, fingerprint, **params):
+        """
+        Set paths and edges from cache if present
+
+        :return: True if found in cache
+        """
+        self.cache = cache
+        self.cache_key = cache.key(fingerprint,
+                                   graph=type(self).__name__,
+                                   id_col=self.id_col,
+                                   behaviour_col=self.behaviour_col,
+                                   ts_col=self.ts_col,
+                                   **params)
+        with stage(self.instrumentation, 'load_cache') as record:
+            cached = cache.load_graph(self.cache_key)
+            record['hit'] = cached is not None
+        if cached is None:
+            return False
+        paths, edges, _ = cached
+        self._set_edges(paths, edges,
+                        node_mapping=params['node_mapping'],
+                        skip_backref=params['skip_backref'],
+                        min_edges=params['min_edges'],
+                        max_edges=params['max_edges'])
+        return True
+
+    @classmethod
+    def from_chunks(cls, chunks,
+                    id_col,
+                    behaviour_col,
+                    ts_col,
+                    keep_paths=True,
+                    node_mapping=None,
+                    skip_backref=True,
+                    max_edges=200,
+                    min_edges=0,
+                    cache=None,
+                    fingerprint=None,
+                    instrumentation=None):
+        """
+        Build graph from an iterator of dataframes without holding all
+        rows in memory, e.g. pd.read_csv(f, chunksize=100000)
+
+        Chunks must be ordered by `ts_col` globally. The resulting graph
+        has no `df`.
+
+        :param: keep_paths [bool] Keep the path of each user, needed for
+            path_aggregate_df and funnels
+        :param: cache [GraphCache] Skip reading the chunks if built before,
+            requires `fingerprint` of the input
+        """
+        g = cls(None,
+                id_col=id_col,
+                behaviour_col=behaviour_col,
+                ts_col=ts_col,
+                init=False,
+                instrumentation=instrumentation)
+        params = dict(node_mapping=node_mapping,
+                      skip_backref=skip_backref,
+                      min_edges=min_edges,
+                      max_edges=max_edges)
+        if cache is not None:
+            if fingerprint is None:
+                raise ValueError("Caching chunks requires a fingerprint")
+            if g.__load_cache(cache, fingerprint,
+                              keep_paths=keep_paths, **params):
+                return g
+
+        with stage(instrumentation, 'extract_paths', rows=0,
+                   chunks=0) as record:
+            builder = StreamingPathBuilder(id_col, behaviour_col, ts_col,
+                                           keep_paths=keep_paths)
+            for chunk in chunks:
+                builder.add_chunk(chunk)
+                record['rows'] += len(chunk)
+                record['chunks'] += 1
+            paths, edges = builder.finish(node_mapping=node_mapping)
+            record['users'] = None if paths is None else len(paths)
+            record['edges'] = len(edges)
+
+        g._set_edges(paths, edges,
+                     node_mapping=node_mapping,
+                     skip_backref=skip_backref,
+                     min_edges=min_edges,
+                     max_edges=max_edges)
+        if cache is not None:
+            cache.save_graph(g.cache_key, paths, edges)
+        assert len(g.transitions) > 0
+        return g
+
+    def _set_edges(self, paths, edges,
+                   node_mapping=None,
+                   skip_backref=True,
+                   max_edges=200,
+                   min_edges=0,
+                   update_state=None):
+        """
+        Keep the parsed paths and edges, and create the Network X graph
+
+        :param: update_state - (pending, tentative, latest_ts) of update()
+            matching paths, reset when None as paths came from elsewhere
+        """
+        if paths is not None:
+            first = paths.vocab[paths.codes[paths.offsets[:-1]]]
+            assert (first == 'start').any()
+        else:
+            assert len([n for n in edges.vocab[edges.edges['src']]
+                        if 'start' in n]) > 0
+
+        self.paths = paths
+        self._set_update_state(*(update_state or ()))
+        self.edges = edges
+        self._user_count = None
+        self.node_mapping = node_mapping
+        self.skip_backref = skip_backref
+        self.max_edges = max_edges
+        self.min_edges = min_edges
+        with stage(self.instrumentation, 'create_graph',
+                   edges=len(edges)) as record:
+            self.transitions = self.__create_graph_from_edges(
+                edges, skip_backref=skip_backref,
+                min_edges=min_edges,
+                max_edges=max_edges,
+                counters=record
+            )
+            record['nodes'] = len(self.transitions)
+
+    def _set_update_state(self, pending=None, tentative=None,
+                          latest_ts=None):
+        """ Events that can still be reordered by update(), and the
+        tentative behaviours they added to the end of paths
+        """
+        self._pending = pending
+        self._tentative = pd.Series([], dtype=int) if tentative is None \
+            else tentative
+        self._latest_ts = latest_ts
+
+    @property
+    def G(self):
+        """ Network X view of the transitions, built on first use
+        """
+        if self._G is None and self._transitions is not None:
+            self._G = self._transitions.to_networkx()
+        return self._G
+
+    @G.setter
+    def G(self, G):
+        self._G = G
+        self._transitions = None
+        self._node_index = None
+        # graph no longer matches the cached build
+        self.cache = None
+
+    @property
+    def transitions(self):
+        """ TransitionMatrix of the graph. Once G is built it is the source
+        of truth, the matrix is derived again if G was set or its nodes or
+        edges were edited in place.
+        """
+        G = self._G
+        if G is not None and (self._transitions is None or
+                              not self._transitions.matches_graph(G)):
+            self._transitions = TransitionMatrix.from_graph(G)
+        return self._transitions
+
+    @transitions.setter
+    def transitions(self, transitions):
+        self._transitions = transitions
+        self._G = None
+        self._node_index = None
+
+    @property
+    def path_aggregate_df(self):
+        """ Path of each user, as a dataframe of label lists, built from
+        paths on first use
+        """
+        if self.paths is None:
+            return None
+        paths, df = self._path_aggregate
+        if paths is not self.paths:
+            df = self.paths.to_frame(self.id_col)
+            self._path_aggregate = (self.paths, df)
+        return df
+
+    @path_aggregate_df.setter
+    def path_aggregate_df(self, df):
+        if df is None:
+            self.paths = None
+        else:
+            self.paths = PathStore.from_lists(df.index, list(df.path))
+            df = df.copy()
+        self._set_update_state()
+        self._path_aggregate = (self.paths, df)
+
+    @property
+    def edge_count(self):
+        """ Counter of all (src, dst) edges before pruning
+        """
+        if self.edges is None:
+            return None
+        return self.edges.to_counter()
+
+    @property
+    def stats(self):
+        """ Records of the instrumented stages, see graphitty.instrument
+        """
+        if self.instrumentation is None:
+            return {}
+        return self.instrumentation.stats
+
+    @property
+    def user_count(self):
+        """ Number of distinct users, without going back to the df
+        """
+        if self._user_count is None:
+            if self.paths is not None:
+                self._user_count = len(self.paths)
+            elif self.edges is not None:
+                self._user_count = self.__count_exit_edges()
+            else:
+                self._user_count = self.df[self.id_col].nunique()
+        return self._user_count
+
+    def __count_exit_edges(self):
+        """ Every user path ends with one edge into exit
+        """
+        exit_label = EXIT
+        for dst, src_list in (self.node_mapping or {}).items():
+            if EXIT in src_list:
+                exit_label = dst
+        edges = self.edges.edges
+        vocab = self.edges.vocab
+        into_exit = (vocab[edges['dst']] == exit_label) & \
+            (edges['src'] != edges['dst'])
+        count = int(edges['count'][into_exit].sum())
+        if count == 0:
+            raise ValueError(
+                "No edge into {}, cannot count users".format(exit_label))
+        return count
+
+    def update(self, new_df, window=None):
+        """
+        Extend paths and edge counts with new events, then refresh G under
+        the same node_mapping / skip_backref / max_edges / min_edges
+
+        Events seen before are not re-parsed. Note `df` is not extended.
+
+        :param: window - events within `window` (in units of ts_col, e.g.
+            pd.Timedelta) of the latest event are kept pending and can
+            still be reordered by late events, older events are final.
+            Events later than that are appended to the end of the path.
+        """
+        if self.paths is None:
+            raise ValueError("Cannot update a graph without paths")
+        with stage(self.instrumentation, 'update',
+                   rows=len(new_df)) as record:
+            paths = self.__update(new_df, window, record)
+        return paths
+
+    def __update(self, new_df, window, record):
+        rows = pd.DataFrame({
+            'uid': new_df[self.id_col].values,
+            'ts': new_df[self.ts_col].values,
+            'node': clean_behaviour(new_df[self.behaviour_col]).values,
+        })
+        if self._pending is not None:
+            rows = pd.concat([self._pending, rows], ignore_index=True)
+        rows = rows[rows['uid'].notnull()]
+        if not len(rows):
+            return self.paths
+
+        latest = self._latest_ts
+        if window is None:
+            is_final = np.ones(len(rows), dtype=bool)
+        else:
+            if latest is None:
+                latest = rows['ts'].max()
+            else:
+                latest = max(rows['ts'].max(), latest)
+            is_final = (rows['ts'] < latest - window).values
+
+        touched, tentative = extend_paths(
+            self.paths, self._tentative,
+            rows['uid'].values, rows['ts'].values, rows['node'].values,
+            is_final)
+        pending = rows[~is_final & rows['node'].notnull().values]
+        update_state = (pending if len(pending) else None,
+                        tentative[tentative > 0], latest)
+
+        record['touched_users'] = len(touched)
+        existing = self.paths.user_ids.get_indexer(touched.user_ids)
+        untouched = np.ones(len(self.paths), dtype=bool)
+        untouched[existing[existing >= 0]] = False
+
+        paths = merge_paths([
+            self.paths.take(np.flatnonzero(untouched)),
+            touched
+        ])
+        # recount rather than add / subtract the touched edges, so that
+        # edges stay in the order of a full build and max_edges ties are
+        # broken the same way. Counting is a single pass over the codes.
+        edges = count_edges(paths, node_mapping=self.node_mapping)
+
+        # graph no longer matches the cached build
+        self.cache = None
+        self._set_edges(paths, edges,
+                        node_mapping=self.node_mapping,
+                        skip_backref=self.skip_backref,
+                        min_edges=self.min_edges,
+                        max_edges=self.max_edges,
+                        update_state=update_state)
+        return self.paths
+
+    def __build_path_by_group(self, node_mapping=None):
+        """
+        Walk each user group with get_template_path
         """
         edge_count = Counter()
 
@@ -68,35 +493,43 @@ class Graphitty(object):
                 self.get_template_path),
             columns=['path']
         )
-
-        assert len([n for n in edge_count.keys() if 'start' in n[0]]) > 0
-
-        self.G = self.__create_graph_from_edges(
-            edge_count, skip_backref=skip_backref,
-            min_edges=min_edges,
-            max_edges=max_edges
-        )
-
-        # now given the edges, create the nxgraph
-        self.path_aggregate_df = path_aggregate
-        return path_aggregate
+        return edge_count, path_aggregate
 
     def __create_graph_from_edges(self, edge_count,
                                   min_edges=0,
                                   skip_backref=True,
-                                  max_edges=200):
-        G = nx.DiGraph()
+                                  max_edges=200,
+                                  counters=None):
+        """
+        :param: counters dict - filled with the number of edges kept and
+            dropped by max_edges / min_edges / skip_backref
+        :return: TransitionMatrix of the kept edges
+        """
         added_edges = {}
 
-        for i, (e, count) in enumerate(edge_count.most_common(max_edges)):
-            if (min_edges is not None) and (count < min_edges):
-                continue
+        # edges below min_edges or skipped as backref do not count towards
+        # max_edges
+        if max_edges is None:
+            max_edges = len(edge_count)
+        seen_edges = 0
+        dropped_backref = 0
+        for e, count in edge_count.iter_most_common(min_count=min_edges,
+                                                    batch=max_edges):
+            if len(added_edges) >= max_edges:
+                break
+            seen_edges += 1
             if skip_backref and ((e[1], e[0]) in added_edges):
+                dropped_backref += 1
                 continue
-            # print "Added edge: {}".format([e[0],e[1]])
-            G.add_edge(e[0], e[1], weight=count)
-            added_edges[(e[0], e[1])] = 1
-        return G
+            added_edges[(e[0], e[1])] = count
+        if counters is not None:
+            above_min_edges = len(edge_count) if min_edges is None else \
+                int((edge_count.edges['count'] >= min_edges).sum())
+            counters['kept_edges'] = len(added_edges)
+            counters['dropped_max_edges'] = above_min_edges - seen_edges
+            counters['dropped_min_edges'] = len(edge_count) - above_min_edges
+            counters['dropped_backref'] = dropped_backref
+        return TransitionMatrix.from_edges(added_edges.items())
 
     def get_template_path(self, group,
                           add_exit=True,
@@ -141,7 +574,9 @@ class Graphitty(object):
         :return: Network x graph
         """
         G = self.G
-        G = self.render_label(G, use_perc_label=use_perc_label)
+        with stage(self.instrumentation, 'render_label',
+                   edges=G.number_of_edges()):
+            G = self.render_label(G, use_perc_label=use_perc_label)
         if filter_subgraph:
             G = self.filter_subgraph(G)
         self.rendered_G = G
@@ -155,102 +590,150 @@ class Graphitty(object):
         """
         Apply label rendering to graph
         """
+        graph_edges = list(G.edges(data=True))
 
-        graph_edges = G.edges(data=True)
-        mapped_edge_count = {
-            (n0, n1): d.get(weight_label)
-            for n0, n1, d in graph_edges
-        }
-
-        if render_func is None:
-            # TODO: better colour map
-            # http://stackoverflow.com/questions/14777066/
-            #   matplotlib-discrete-colorbar
-            color_array = ['red', 'orange', 'yellow', 'grey']
-            if use_perc_label:
-                color_array.reverse()
-
-            max_weight = 100 if use_perc_label else max(
-                mapped_edge_count.values())
-
-        def default_renderer(G, e, count):
-            if use_perc_label:
-                # get all in edge
-                in_count = sum([
-                    c for (n0, n1), c
-                    in mapped_edge_count.items()
-                    if n1 == e[0]
-                ])
-                if in_count == 0:
-                    out_count = sum([
-                        c for (n0, n1), c
-                        in mapped_edge_count.items()
-                        if n0 == e[0]
-                    ])
-                    label = 100. * count / out_count
-                else:
-                    label = 100. * count / in_count
-            else:
-                label = count
+        if render_func is not None:
+            for n0, n1, d in graph_edges:
+                label, edge_color = render_func(
+                    G, (n0, n1), d.get(weight_label))
+                d.update({
+                    'label': label,
+                    'color': edge_color
+                })
+            return G
 
-            try:
-                edge_color = color_array[
-                    int((float(label) / max_weight) *
-                        (len(color_array) - 1))]
-            except IndexError:
-                edge_color = 'grey'
-            label = "{:.1f}%".format(label) if use_perc_label else label
-            return label, edge_color
-
-        if render_func is None:
-            render_func = default_renderer
-
-        for e, count in mapped_edge_count.items():
-            label, edge_color = render_func(G, e, count)
-            G[e[0]][e[1]].update({
+        if not graph_edges:
+            return G
+
+        # TODO: better colour map
+        # http://stackoverflow.com/questions/14777066/
+        #   matplotlib-discrete-colorbar
+        color_array = ['red', 'orange', 'yellow', 'grey']
+        if use_perc_label:
+            color_array.reverse()
+
+        counts = [d.get(weight_label) for _, _, d in graph_edges]
+        weights = np.array(counts, dtype=float)
+        if use_perc_label:
+            transitions = TransitionMatrix.from_edges(
+                ((n0, n1), w) for (n0, n1, _), w in zip(graph_edges, weights))
+            src = transitions.src
+            in_weight = transitions.in_totals
+            out_weight = transitions.out_totals
+            total = np.where(in_weight[src] == 0,
+                             out_weight[src], in_weight[src])
+            values = 100. * weights / total
+            max_weight = 100
+        else:
+            values = weights
+            max_weight = weights.max()
+
+        color_idx = np.trunc(
+            values / max_weight * (len(color_array) - 1)).astype(int)
+        in_range = (color_idx < len(color_array)) & \
+            (color_idx >= -len(color_array))
+
+        for i, (n0, n1, d) in enumerate(graph_edges):
+            edge_color = color_array[color_idx[i]] if in_range[i] else 'grey'
+            label = "{:.1f}%".format(values[i]) if use_perc_label \
+                else counts[i]
+            d.update({
                 'label': label,
                 'color': edge_color
             })
         return G
 
     def get_node(self, G, name):
-        for n in G.nodes():
-            if name in str(n):
-                return n
-        raise IndexError("No node {} found! nodes = {}".format(
-            name, G.nodes()))
+        if G is not self._G:
+            # not worth indexing a graph that is not kept
+            return find_node(G, name)
+        index = self._node_index
+        if index is None or not index.is_valid(G):
+            index = NodeIndex(G)
+            self._node_index = index
+        return index.lookup(name)
 
     def filter_subgraph(self, G, max_path=10):
-        seen_nodes = set()
-        for path in self.get_path_in_weight_order(G)[:max_path]:
-            seen_nodes.update(path)
-        nodes_to_remove = []
-        for n in G.nodes():
-            if n not in seen_nodes:
-                nodes_to_remove.append(n)
-        for n in nodes_to_remove:
-            G.remove_node(n)
+        with stage(self.instrumentation, 'filter_subgraph',
+                   nodes=G.number_of_nodes()) as record:
+            seen_nodes = set()
+            for path in islice(self.iter_path_in_weight_order(G),
+                               max_path):
+                seen_nodes.update(path)
+            nodes_to_remove = []
+            for n in G.nodes():
+                if n not in seen_nodes:
+                    nodes_to_remove.append(n)
+            for n in nodes_to_remove:
+                G.remove_node(n)
+            record['removed_nodes'] = len(nodes_to_remove)
+        if G is self._G:
+            self._node_index = None
+            self._transitions = None
+            # graph no longer matches the cached build
+            self.cache = None
         return G
 
-    def get_path_in_weight_order(self, G=None):
+    def markov_chain(self, G=None, source='start', exit='exit'):
+        """
+        Absorbing Markov chain of the graph, see graphitty.markov
+
+        :param: G - graph to use instead of the transitions, e.g. the
+            rendered graph
+        """
+        if G is None:
+            transitions = self.transitions
+        else:
+            transitions = TransitionMatrix.from_graph(G)
+        with stage(self.instrumentation, 'markov_chain',
+                   nodes=len(transitions),
+                   edges=transitions.edge_count):
+            index = transitions.index
+            # after node mapping start / exit can be e.g. "[1] start"
+            if source not in index or exit not in index:
+                G = self.G if G is None else G
+                source = self.get_node(G, source)
+                exit = self.get_node(G, exit)
+            return MarkovChain(transitions, source=source, exit=exit)
+
+    def iter_path_in_weight_order(self, G=None, weight='weight'):
+        """
+        Lazily yield simple paths from start to exit, most probable first
+
+        Probability of a path is the product of the transition probability
+        of its edges, i.e. edge weight over total out weight of the node.
+        """
+        if G is None:
+            G = self.rendered_G
+        return iter_probable_paths(G,
+                                   source=self.get_node(G, 'start'),
+                                   target=self.get_node(G, 'exit'),
+                                   weight=weight)
+
+    def get_path_in_weight_order(self, G=None, max_path=10):
+        """
+        The `max_path` most probable paths from start to exit
+
+        :param: max_path [int] Number of paths, None enumerates every simple
+            path which grows exponentially with the graph
+        """
         if G is None:
             G = self.rendered_G
-        paths = nx.all_simple_paths(G,
-                                    source=self.get_node(G, 'start'),
-                                    target=self.get_node(G, 'exit')
-                                    )
-        return sorted(paths,
-                      key=lambda p: G[p[0]][p[1]].get('weight'),
-                      reverse=True)
-
-    def get_path_in_weight_order_with_weight(self, G=None):
+        return list(islice(self.iter_path_in_weight_order(G), max_path))
+
+    def get_path_in_weight_order_with_weight(self, G=None, max_path=10):
+        """
+        get_path_in_weight_order with the weight of the first edge and the
+        probability of every path
+        """
         if G is None:
             G = self.rendered_G
-        paths = self.get_path_in_weight_order(G)
+        paths = self.get_path_in_weight_order(G, max_path=max_path)
         return [
             {
                 'path': p,
-                'weight': G[p[0]][p[1]].get('weight')
+                'weight': G[p[0]][p[1]].get('weight'),
+                'probability': path_probability(G, p),
             }
             for p in paths
         ]
@@ -262,25 +745,70 @@ class Graphitty(object):
         NOTE: return new graph
         """
         mapping = self.get_simplify_mapping()
+        g = self.remap(mapping)
+
+        assert len(g.transitions) > 0
+        return g
+
+    def remap(self, node_mapping,
+              skip_backref=True,
+              max_edges=200,
+              min_edges=0):
+        """
+        Return new graph with the edge counts mapped through node_mapping,
+        same as building with node_mapping but without re-parsing the df.
+        The user paths are shared, along with the events update() keeps
+        pending on them.
+
+        :param: node_mapping dict - a dictionary of {dst : [src]}
+        """
         g = Graphitty(
             self.df,
             id_col=self.id_col,
             behaviour_col=self.behaviour_col,
             ts_col=self.ts_col,
-            node_mapping=mapping)
-
-        assert len(g.G.nodes()) > 0
+            init=False,
+            workers=self.workers,
+            instrumentation=self.instrumentation)
+        with stage(self.instrumentation, 'remap',
+                   edges=len(self.edges)) as record:
+            edges = self.edges.remap(node_mapping)
+            record['mapped_edges'] = len(edges)
+        with namespace(self.instrumentation, 'remap'):
+            g._set_edges(self.paths, edges,
+                         node_mapping=compose_mapping(self.node_mapping,
+                                                      node_mapping),
+                         skip_backref=skip_backref,
+                         min_edges=min_edges,
+                         max_edges=max_edges,
+                         update_state=(self._pending, self._tentative,
+                                       self._latest_ts))
         return g
 
     def get_simplify_mapping(self, shorten=True):
-        assert self.G
-        G = self.G
+        if self.cache is not None:
+            name = 'simplify_mapping_shorten' if shorten \
+                else 'simplify_mapping'
+            entry = self.cache.load(self.cache_key) or {}
+            if name in entry:
+                return self.cache.decode_mapping(entry[name])
+            mapping = self.__get_simplify_mapping(shorten=shorten)
+            if entry:
+                entry[name] = self.cache.encode_mapping(mapping)
+                self.cache.save(self.cache_key, **entry)
+            return mapping
+        return self.__get_simplify_mapping(shorten=shorten)
+
+    def __get_simplify_mapping(self, shorten=True):
+        assert self.transitions is not None
 
-        scc = list(nx.strongly_connected_components(G))
-        G = nx.condensation(G, scc=scc)
+        with stage(self.instrumentation, 'condensation',
+                   nodes=len(self.transitions)) as record:
+            scc = self.transitions.strongly_connected_components()
+            record['components'] = len(scc)
 
         relabel_mapping = {}
-        for node in G.nodes():
+        for node in range(len(scc)):
             node_name = "[{}] {}".format(
                 len(scc[node]),
                 ','.join(scc[node])
@@ -288,9 +816,11 @@ class Graphitty(object):
             relabel_mapping[node_name] = scc[node]
 
         if shorten:
-            shorten_mapping = self.shorten_name(
-                node_list=relabel_mapping.keys()
-            )
+            with stage(self.instrumentation, 'shorten_name',
+                       nodes=len(relabel_mapping)):
+                shorten_mapping = self.shorten_name(
+                    node_list=relabel_mapping.keys()
+                )
             relabel_mapping = {
                 shorten_mapping[old_name]: orig_nodes
                 for old_name, orig_nodes in relabel_mapping.items()
@@ -311,8 +841,8 @@ class Graphitty(object):
         # use inverse doc frequency mapping
 
         if node_list is None:
-            node_list = G.nodes()
             G = self.G
+            node_list = list(G.nodes())
         else:
             G = None
 
@@ -336,6 +866,168 @@ class Graphitty(object):
         return relabel_mapping
 
 
+class NodeIndex(object):
+    """
+    Lookup of graph nodes by name
+
+    Tries in order: exact name, the special start / exit node, prefix of a
+    name and finally substring of a name.
+    """
+
+    SPECIAL_NODES = ('start', 'exit')
+
+    def __init__(self, G):
+        self.G = G
+        self.nodes = list(G.nodes())
+        self.node_set = frozenset(self.nodes)
+        self.exact = {}
+        for n in self.nodes:
+            self.exact.setdefault(str(n), n)
+        self.sorted_names = sorted(self.exact)
+
+        # after node mapping start / exit can be e.g. "[1] start", prefer
+        # the node that has no in / out edge
+        self.special = {}
+        for name, degree in zip(self.SPECIAL_NODES,
+                                (G.in_degree, G.out_degree)):
+            if name in self.exact:
+                continue
+            candidates = [n for n in self.nodes if name in str(n)]
+            if candidates:
+                self.special[name] = min(
+                    candidates, key=lambda n: degree(n) > 0)
+
+    def is_valid(self, G):
+        """ Same graph with the same nodes, e.g. not relabeled in place
+
+        Nodes added to a graph go after the existing ones, so with the
+        same node count a remove + add or relabel shows as a different last
+        node, checked in O(1).
+        """
+        if self.G is not G or len(self.nodes) != G.number_of_nodes():
+            return False
+        if not self.nodes:
+            return True
+        try:
+            last = next(reversed(G._node))
+        except (AttributeError, TypeError):
+            # nodes are not kept in insertion order
+            return self.node_set.issuperset(G)
+        return last == self.nodes[-1]
+
+    def lookup(self, name):
+        if name in self.exact:
+            return self.exact[name]
+        if name in self.special:
+            return self.special[name]
+        i = bisect_left(self.sorted_names, name)
+        if i < len(self.sorted_names) and \
+                self.sorted_names[i].startswith(name):
+            return self.exact[self.sorted_names[i]]
+        for n in self.nodes:
+            if name in str(n):
+                return n
+        raise IndexError("No node {} found! nodes = {}".format(
+            name, self.nodes))
+
+
+def find_node(G, name):
+    """
+    Same lookup as NodeIndex in a single scan of the nodes, for graphs
+    looked up only a few times
+    """
+    special = name in NodeIndex.SPECIAL_NODES
+    degree = G.in_degree if name == 'start' else G.out_degree
+    special_node = None
+    prefix = None
+    substring = None
+    for n in G.nodes():
+        s = str(n)
+        if s == name:
+            return n
+        if name not in s:
+            continue
+        if substring is None:
+            substring = n
+        if special and (special_node is None or
+                        (degree(special_node) > 0 and degree(n) == 0)):
+            special_node = n
+        if s.startswith(name) and (prefix is None or s < str(prefix)):
+            prefix = n
+    for n in (special_node, prefix, substring):
+        if n is not None:
+            return n
+    raise IndexError("No node {} found! nodes = {}".format(
+        name, list(G.nodes())))
+
+
+def compose_mapping(first, second):
+    """
+    Node mapping equivalent to mapping with `first` and then `second`
+
+    :param: first, second dict - a dictionary of {dst : [src]}
+    """
+    if not first:
+        return second
+    src_dst_first = {
+        src: dst for dst, src_list in first.items() for src in src_list}
+    src_dst_second = {
+        src: dst for dst, src_list in second.items() for src in src_list}
+    mapping = defaultdict(set)
+    for src, dst in src_dst_first.items():
+        mapping[src_dst_second.get(dst, dst)].add(src)
+    for src, dst in src_dst_second.items():
+        if src not in src_dst_first:
+            mapping[dst].add(src)
+    return dict(mapping)
+
+
+def transition_costs(G, weight='weight'):
+    """
+    Graph with -log(transition probability) of each edge as 'cost'
+    """
+    transitions = TransitionMatrix.from_graph(G, weight=weight)
+    probability = transitions.edge_probabilities()
+    nodes = transitions.nodes
+
+    H = nx.DiGraph()
+    H.add_nodes_from(G)
+    kept = probability > 0
+    H.add_edges_from(
+        (n0, n1, {'cost': cost})
+        for n0, n1, cost in zip(nodes[transitions.src[kept]].tolist(),
+                                nodes[transitions.dst[kept]].tolist(),
+                                (-np.log(probability[kept])).tolist()))
+    return H
+
+
+def iter_probable_paths(G, source, target, weight='weight'):
+    """
+    Yield simple paths from source to target by decreasing probability
+
+    Uses k-shortest simple paths over -log(probability), so only as many
+    paths as consumed are searched for.
+    """
+    H = transition_costs(G, weight=weight)
+    try:
+        for path in nx.shortest_simple_paths(H, source, target,
+                                             weight='cost'):
+            yield path
+    except nx.NetworkXNoPath:
+        return
+
+
+def path_probability(G, path, weight='weight'):
+    out_weight = {}
+    probability = 1.
+    for n0, n1 in zip(path[:-1], path[1:]):
+        if n0 not in out_weight:
+            out_weight[n0] = sum(
+                edge_weight(d, weight) for d in G[n0].values())
+        probability *= 1. * edge_weight(G[n0][n1], weight) / out_weight[n0]
+    return probability
+
+
 def tf_idf(docs, max_doc_freq=None):
     """
     Calculate tf, idf for each item
@@ -0,0 +1,124 @@
+"""
+Opt-in instrumentation of the stages of building and analysing graphs
+
+    instrumentation = Instrumentation(callbacks=[send_to_metrics],
+                                      memory=True)
+    g = Graphitty(df, ..., instrumentation=instrumentation)
+    g.stats['create_graph']['dropped_max_edges']
+
+Every stage records its wall time in `seconds`, the peak memory allocated
+during the stage in `peak_bytes` if `memory` is set, and its own counters
+such as rows, users or edges.
+
+`stats` keeps the latest record of every stage name, `records` every
+record in order. Stages of graphs built while analysing another graph, e.g.
+by simplify, are recorded under a namespace such as 'remap.create_graph',
+so they do not replace the records of the original build.
+"""
+import time
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+
+class Instrumentation(object):
+
+    def __init__(self, callbacks=None, memory=False):
+        """
+        :param: callbacks - called with (stage, record) when a stage ends
+        :param: memory [bool] Trace peak memory of every stage, python 3
+            only and slows down the stages
+        """
+        self.stats = {}
+        # (stage, record) of every stage run, in order
+        self.records = []
+        self.callbacks = list(callbacks or [])
+        self.memory = memory and tracemalloc is not None
+        # peak memory of the running stages, outermost first
+        self._peaks = []
+        self._started_tracing = False
+        self._namespace = []
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    @contextmanager
+    def namespace(self, name):
+        """ Record the stages run within as `name.stage`
+        """
+        self._namespace.append(name)
+        try:
+            yield
+        finally:
+            self._namespace.pop()
+
+    @contextmanager
+    def stage(self, name, **counters):
+        """
+        Record a stage, counters can be added to the yielded record
+        """
+        name = '.'.join(self._namespace + [name])
+        record = dict(counters)
+        if self.memory:
+            self.__enter_memory()
+        start = time.time()
+        try:
+            yield record
+            record['seconds'] = time.time() - start
+            if self.memory:
+                record['peak_bytes'] = self.__exit_memory()
+        except BaseException:
+            if self.memory:
+                self.__exit_memory()
+            raise
+        self.stats[name] = record
+        self.records.append((name, record))
+        for callback in self.callbacks:
+            callback(name, record)
+
+    def __enter_memory(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        current, peak = tracemalloc.get_traced_memory()
+        if self._peaks:
+            self._peaks[-1][1] = max(self._peaks[-1][1], peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self._peaks.append([current, current])
+
+    def __exit_memory(self):
+        _, peak = tracemalloc.get_traced_memory()
+        start, child_peak = self._peaks.pop()
+        peak = max(peak, child_peak)
+        if self._peaks:
+            self._peaks[-1][1] = max(self._peaks[-1][1], peak)
+        elif self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return peak - start
+
+
+@contextmanager
+def stage(instrumentation, name, **counters):
+    """ Instrumentation.stage, or a no-op if instrumentation is None
+    """
+    if instrumentation is None:
+        yield dict(counters)
+    else:
+        with instrumentation.stage(name, **counters) as record:
+            yield record
+
+
+@contextmanager
+def namespace(instrumentation, name):
+    """ Instrumentation.namespace, or a no-op if instrumentation is None
+    """
+    if instrumentation is None:
+        yield
+    else:
+        with instrumentation.namespace(name):
+            yield
@@ -0,0 +1,180 @@
+"""
+The graph of a Graphitty as an absorbing Markov chain from start to exit
+
+    chain = g.markov_chain()
+    chain.absorption_probabilities('/shuttle/countdown/')[chain.index['start']]
+    chain.expected_steps()
+    chain.visit_rates()
+
+Every quantity is one sparse linear solve over the transition
+probabilities, so it covers all paths at once instead of enumerating them.
+Exit and every node without out edges (e.g. after pruning edges) are
+absorbing: users leave the site there.
+"""
+from __future__ import division
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+from scipy.sparse.linalg import spsolve
+
+
+def can_reach(matrix, mask):
+    """
+    :param: matrix - sparse adjacency matrix, row = src
+    :param: mask - boolean array of the nodes to reach
+    :return: boolean array of nodes with a path to any node of mask
+    """
+    n = matrix.shape[0]
+    targets = np.flatnonzero(mask)
+    # reversed graph plus a virtual node n with an edge to every target
+    reverse = matrix.T.tocoo()
+    reverse = sparse.csr_matrix(
+        (np.concatenate([reverse.data, np.ones(len(targets))]),
+         (np.concatenate([reverse.row, np.full(len(targets), n)]),
+          np.concatenate([reverse.col, targets]))),
+        shape=(n + 1, n + 1))
+    reached = np.zeros(n + 1, dtype=bool)
+    reached[csgraph.breadth_first_order(
+        reverse, n, directed=True, return_predecessors=False)] = True
+    return reached[:n]
+
+
+class MarkovChain(object):
+    """
+    Absorbing Markov chain over a TransitionMatrix
+    """
+
+    def __init__(self, transitions, source='start', exit='exit'):
+        """
+        :param: transitions - TransitionMatrix
+        :param: source, exit - labels of the start and exit nodes
+        """
+        self.transitions = transitions
+        self.nodes = transitions.nodes
+        self.index = transitions.index
+        self.source = self.index[source]
+        self.exit = self.index[exit]
+        self.P = transitions.probabilities
+
+        self.absorbing = transitions.out_totals == 0
+        self.absorbing[self.exit] = True
+        self._certain = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _node_mask(self, nodes):
+        mask = np.zeros(len(self.nodes), dtype=bool)
+        if not isinstance(nodes, (list, tuple, set)):
+            nodes = [nodes]
+        for n in nodes:
+            mask[self.index[n]] = True
+        return mask
+
+    @property
+    def certain(self):
+        """ Boolean array of the nodes absorbed with probability 1, i.e.
+        that cannot walk into a cycle without a way out
+        """
+        if self._certain is None:
+            trapped = ~can_reach(self.P, self.absorbing)
+            self._certain = ~can_reach(self.P, trapped)
+        return self._certain
+
+    def _solve(self, transient, b, transpose=False):
+        """ Solve (I - Q) x = b with Q the transitions among `transient`
+        """
+        idx = np.flatnonzero(transient)
+        if not len(idx):
+            return np.zeros(0)
+        Q = self.P[idx][:, idx]
+        A = sparse.identity(len(idx), format='csc') - Q.tocsc()
+        if transpose:
+            A = A.T.tocsc()
+        return np.atleast_1d(spsolve(A, b))
+
+    def absorption_probabilities(self, target):
+        """
+        Probability of reaching `target` before leaving, from every node
+
+        :param: target - node label or list of labels, reaching any counts
+        :return: array aligned with nodes, 1 on the targets
+        """
+        is_target = self._node_mask(target)
+        # only the nodes with a path to a target have a nonzero probability,
+        # and restricted to them the system is non singular
+        transient = can_reach(self.P, is_target) & \
+            ~is_target & ~self.absorbing
+        b = np.asarray(
+            self.P[np.flatnonzero(transient)][:, np.flatnonzero(is_target)]
+            .sum(axis=1)).ravel()
+        probabilities = np.zeros(len(self.nodes))
+        probabilities[transient] = self._solve(transient, b)
+        probabilities[is_target] = 1.
+        return probabilities
+
+    def expected_steps(self):
+        """
+        Expected number of transitions until leaving, from every node
+
+        :return: array aligned with nodes, 0 on absorbing nodes and inf on
+            nodes that may never leave
+        """
+        transient = self.certain & ~self.absorbing
+        steps = np.full(len(self.nodes), np.inf)
+        steps[self.absorbing] = 0.
+        steps[transient] = self._solve(transient,
+                                       np.ones(transient.sum()))
+        return steps
+
+    def expected_visits(self, source=None):
+        """
+        Expected number of visits of every node by a user starting at
+        `source`, the source row of the fundamental matrix (I - Q)^-1 plus
+        the final visit of the absorbing nodes
+
+        :param: source - node label, the start node by default
+        """
+        source = self.source if source is None else self.index[source]
+        if not self.certain[source]:
+            raise ValueError(
+                "Users from {} may never leave".format(self.nodes[source]))
+        # every node reachable from a certain node is certain
+        transient = self.certain & ~self.absorbing
+        visits = np.zeros(len(self.nodes))
+        if self.absorbing[source]:
+            visits[source] = 1.
+            return visits
+        b = (np.flatnonzero(transient) == source).astype(float)
+        visits[transient] = self._solve(transient, b, transpose=True)
+        # absorbing nodes are visited once, when users arrive there
+        absorbed = self.P.T.dot(visits)
+        visits[self.absorbing] = absorbed[self.absorbing]
+        return visits
+
+    def visit_rates(self, source=None):
+        """
+        Stationary distribution of the chain restarted at `source` on
+        leaving, i.e. share of all page views spent on every node
+        """
+        visits = self.expected_visits(source)
+        return visits / visits.sum()
+
+    def to_frame(self, target=None):
+        """
+        :param: target - node label(s), adds the probability of reaching them
+        :return: DataFrame indexed by node with expected_visits, visit_rate,
+            expected_steps and probability if target is given
+        """
+        visits = self.expected_visits()
+        df = pd.DataFrame({
+            'expected_visits': visits,
+            'visit_rate': visits / visits.sum(),
+            'expected_steps': self.expected_steps(),
+        }, index=pd.Index(self.nodes, name='node'),
+            columns=['expected_visits', 'visit_rate', 'expected_steps'])
+        if target is not None:
+            df['probability'] = self.absorption_probabilities(target)
+        return df
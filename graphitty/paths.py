@@ -0,0 +1,797 @@
+"""
+Batched path extraction
+
+Turn a whole event dataframe into per-user paths and edge counts in a
+handful of vectorized passes, instead of sorting and walking every user
+group in python.
+
+Behaviours are interned once into int32 codes. Paths are kept as a CSR
+layout (offsets + codes) and edges as a (src, dst, count) array, string
+labels are only looked up when a graph or a dataframe is materialized.
+"""
+import numbers
+from collections import Counter
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+START = 'start'
+EXIT = 'exit'
+
+# reserved codes of every vocabulary built by extract_paths
+START_CODE = 0
+EXIT_CODE = 1
+
+EDGE_DTYPE = np.dtype([
+    ('src', np.int32),
+    ('dst', np.int32),
+    ('count', np.int64),
+])
+
+
+class PathStore(object):
+    """
+    Paths of all users in CSR layout
+
+    Path of user i is vocab[codes[offsets[i]:offsets[i + 1]]]
+    """
+
+    def __init__(self, user_ids, offsets, codes, vocab):
+        self.user_ids = user_ids
+        self.offsets = offsets
+        self.codes = codes
+        self.vocab = vocab
+
+    @classmethod
+    def from_lists(cls, user_ids, paths):
+        lengths = [len(p) for p in paths]
+        offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        flat = [n for p in paths for n in p]
+        codes, vocab = pd.factorize(
+            np.concatenate([[START, EXIT], np.array(flat, dtype=object)]))
+        return cls(pd.Index(user_ids), offsets,
+                   codes[2:].astype(np.int32), np.asarray(vocab, dtype=object))
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def path(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return list(self.vocab[self.codes[start:end]])
+
+    def to_lists(self):
+        labels = self.vocab[self.codes]
+        return [list(p) for p in np.split(labels, self.offsets[1:-1])]
+
+    def to_frame(self, id_col=None):
+        """ Materialize as a dataframe with one list of labels per user
+        """
+        return pd.DataFrame(
+            {'path': self.to_lists()},
+            index=pd.Index(self.user_ids, name=id_col),
+            columns=['path'])
+
+    def take(self, idx):
+        """ PathStore of the users at idx
+        """
+        lengths = self.lengths()[idx]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        gather = np.repeat(self.offsets[idx] - offsets[:-1], lengths) + \
+            np.arange(offsets[-1])
+        return PathStore(self.user_ids[idx], offsets, self.codes[gather],
+                         self.vocab)
+
+    def edge_codes(self):
+        """ Consecutive (src, dst) codes of all paths, in path order
+        """
+        is_src = np.ones(len(self.codes), dtype=bool)
+        # end of each path does not lead into the next path
+        is_src[self.offsets[1:] - 1] = False
+        return self.codes[is_src], self.codes[np.roll(is_src, 1)]
+
+
+class EdgeTable(object):
+    """
+    Edge counts as a compact (src, dst, count) array over a vocabulary
+
+    Edges are kept in order of first occurence.
+    """
+
+    def __init__(self, edges, vocab):
+        self.edges = edges
+        self.vocab = vocab
+
+    @classmethod
+    def from_codes(cls, src, dst, vocab, counts=None):
+        """
+        Aggregate (src, dst) code pairs, each pair counted once or by
+        `counts` if given
+        """
+        keys = src.astype(np.int64) * len(vocab) + dst
+        uniq_idx, uniq_keys = pd.factorize(keys)
+        edges = np.empty(len(uniq_keys), dtype=EDGE_DTYPE)
+        edges['src'] = uniq_keys // len(vocab)
+        edges['dst'] = uniq_keys % len(vocab)
+        edges['count'] = np.bincount(uniq_idx, weights=counts,
+                                     minlength=len(uniq_keys))
+        return cls(edges, vocab)
+
+    @classmethod
+    def from_counter(cls, edge_count):
+        if not edge_count:
+            return cls(np.empty(0, dtype=EDGE_DTYPE),
+                       np.empty(0, dtype=object))
+        src, dst = zip(*edge_count.keys())
+        codes, vocab = pd.factorize(np.array(src + dst, dtype=object))
+        edges = np.empty(len(edge_count), dtype=EDGE_DTYPE)
+        edges['src'] = codes[:len(src)]
+        edges['dst'] = codes[len(src):]
+        edges['count'] = list(edge_count.values())
+        return cls(edges, np.asarray(vocab, dtype=object))
+
+    def __len__(self):
+        return len(self.edges)
+
+    def most_common(self, n=None):
+        """ Same as Counter.most_common, ties kept in insertion order
+        """
+        counts = self.edges['count']
+        order = top_order(counts, len(counts) if n is None else n)
+        return self.__labelled(order)
+
+    def iter_most_common(self, min_count=None, batch=200):
+        """
+        Lazily yield edges in most_common order, skipping edges below
+        min_count. Edges are partially sorted `batch` at a time, doubling
+        the batch whenever more edges are consumed.
+        """
+        counts = self.edges['count']
+        candidates = None
+        if min_count is not None:
+            candidates = np.flatnonzero(counts >= min_count)
+            counts = counts[candidates]
+        done = 0
+        batch = max(batch, 1)
+        while done < len(counts):
+            order = top_order(counts, batch)[done:]
+            if candidates is not None:
+                order = candidates[order]
+            for edge in self.__labelled(order):
+                yield edge
+            done = min(batch, len(counts))
+            batch *= 2
+
+    def __labelled(self, idx):
+        return [
+            ((self.vocab[src], self.vocab[dst]), int(count))
+            for src, dst, count in self.edges[idx].tolist()
+        ]
+
+    def remap(self, node_mapping):
+        """
+        Map edges through node_mapping, edges that fall onto the same
+        (src, dst) are summed
+
+        Gives the same counts as count_edges with node_mapping, as mapping
+        is applied to each edge. Edges within a mapped group become self
+        loops.
+
+        :param: node_mapping dict - a dictionary of {dst : [src]}
+        """
+        code_mapping, vocab = map_vocab(self.vocab, node_mapping)
+        return EdgeTable.from_codes(code_mapping[self.edges['src']],
+                                    code_mapping[self.edges['dst']],
+                                    vocab, counts=self.edges['count'])
+
+    def to_counter(self):
+        edge_count = Counter()
+        for (src, dst), count in zip(
+                zip(self.vocab[self.edges['src']],
+                    self.vocab[self.edges['dst']]),
+                self.edges['count'].tolist()):
+            edge_count[(src, dst)] = count
+        return edge_count
+
+
+def top_order(counts, n):
+    """
+    Indices of the `n` largest counts, largest first and ties in index
+    order, as a stable sort would give, without sorting all counts
+    """
+    if n >= len(counts):
+        return np.argsort(-counts, kind='mergesort')
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    kth = np.partition(counts, len(counts) - n)[len(counts) - n]
+    above = np.flatnonzero(counts > kth)
+    ties = np.flatnonzero(counts == kth)[:n - len(above)]
+    idx = np.concatenate([above, ties])
+    return idx[np.argsort(-counts[idx], kind='mergesort')]
+
+
+def clean_behaviour(series):
+    """ Strip behaviour values, non-string values become null
+    """
+    try:
+        return series.str.strip()
+    except AttributeError:
+        # no string value at all
+        return pd.Series(np.nan, index=series.index, dtype=object)
+
+
+def extract_paths(df, id_col, behaviour_col, ts_col):
+    """
+    Extract the de-duplicated path of every user
+
+    Equivalent to sorting each user group by `ts_col` and keeping the first
+    occurence of each (stripped) behaviour, wrapped with start / exit.
+
+    :return: PathStore
+    """
+    return build_paths(*sort_events(df, id_col, behaviour_col, ts_col))
+
+
+def sort_events(df, id_col, behaviour_col, ts_col):
+    """
+    Intern user ids and behaviours, then sort the behaviours of every user
+    by time keeping the first occurence of each
+
+    :return: (user_ids, uid, codes, vocab) as taken by build_paths
+    """
+    frame = pd.DataFrame({
+        'uid': df[id_col].values,
+        'ts': df[ts_col].values,
+        'node': clean_behaviour(df[behaviour_col]).values,
+    })
+    uid, user_ids = pd.factorize(frame['uid'], sort=True)
+    frame['uid'] = uid
+    # groupby drops users with null id
+    frame = frame[frame['uid'] >= 0]
+
+    frame = frame[frame['node'].notnull()]
+    node_codes, vocab = pd.factorize(
+        np.concatenate([[START, EXIT], frame['node'].values]))
+    frame = pd.DataFrame({
+        'uid': frame['uid'].values,
+        'ts': frame['ts'].values,
+        'code': node_codes[2:].astype(np.int32),
+    })
+    frame = frame.sort_values(['uid', 'ts'], kind='mergesort')
+    frame = frame.drop_duplicates(['uid', 'code'], keep='first')
+    return (user_ids, frame['uid'].values, frame['code'].values,
+            np.asarray(vocab, dtype=object))
+
+
+def build_paths(user_ids, uid, codes, vocab):
+    """
+    Wrap de-duplicated behaviours with start / exit into a PathStore
+
+    :param: uid - sorted index into user_ids of each behaviour
+    :param: codes - behaviour codes in path order, start and exit must be
+        coded START_CODE and EXIT_CODE in vocab
+    """
+    user_count = len(user_ids)
+    lengths = np.bincount(uid, minlength=user_count) + 2
+    offsets = np.zeros(user_count + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    path_codes = np.empty(offsets[-1], dtype=np.int32)
+    path_codes[offsets[:-1]] = START_CODE
+    path_codes[offsets[1:] - 1] = EXIT_CODE
+    position = pd.Series(uid).groupby(uid).cumcount().values + 1
+    path_codes[offsets[uid] + position] = codes
+
+    return PathStore(user_ids, offsets, path_codes, vocab)
+
+
+def extend_paths(paths, tentative, uid, ts, nodes, is_final):
+    """
+    Append new behaviours to the paths of the users they belong to
+
+    The last `tentative[user]` behaviours of a path came from events that
+    were not final yet. They are recomputed together with the new events.
+
+    :param: tentative pd.Series - count of tentative behaviours per user
+    :param: uid, ts, nodes - new events, including not final events from
+        earlier updates
+    :param: is_final - events that can no longer be reordered
+
+    :return: (PathStore of touched users, tentative count of touched users)
+    """
+    t_idx, touched_ids = pd.factorize(uid, sort=True)
+    touched_ids = pd.Index(touched_ids)
+    existing = paths.user_ids.get_indexer(touched_ids)
+
+    # final part of existing paths, without start and exit
+    has_path = np.flatnonzero(existing >= 0)
+    prefix_len = paths.lengths()[existing[has_path]] - 2 - \
+        tentative.reindex(touched_ids[has_path]).fillna(0).values.astype(int)
+    prefix_t = np.repeat(has_path, prefix_len)
+    prefix_offsets = np.zeros(len(has_path) + 1, dtype=np.int64)
+    np.cumsum(prefix_len, out=prefix_offsets[1:])
+    gather = np.repeat(paths.offsets[existing[has_path]] + 1 -
+                       prefix_offsets[:-1], prefix_len) + \
+        np.arange(prefix_offsets[-1])
+    prefix = pd.DataFrame({
+        't': prefix_t,
+        'new': False,
+        'ts': np.arange(len(gather)),
+        'node': paths.vocab[paths.codes[gather]],
+        'final': True,
+    })
+
+    valid = pd.notnull(nodes)
+    new = pd.DataFrame({
+        't': t_idx[valid],
+        'new': True,
+        'ts': ts[valid],
+        'node': nodes[valid],
+        'final': is_final[valid],
+    })
+    new = new.sort_values(['t', 'ts'], kind='mergesort')
+    new['ts'] = np.arange(len(new))
+
+    frame = pd.concat([prefix, new], ignore_index=True)
+    frame = frame.sort_values(['t', 'new', 'ts'], kind='mergesort')
+    frame = frame.drop_duplicates(['t', 'node'], keep='first')
+
+    codes, vocab = pd.factorize(
+        np.concatenate([[START, EXIT], frame['node'].values]))
+    touched = build_paths(touched_ids, frame['t'].values,
+                          codes[2:].astype(np.int32),
+                          np.asarray(vocab, dtype=object))
+    not_final = frame[~frame['final'].values.astype(bool)]
+    touched_tentative = pd.Series(
+        np.bincount(not_final['t'].values, minlength=len(touched_ids)),
+        index=touched_ids)
+    return touched, touched_tentative
+
+
+class StreamingPathBuilder(object):
+    """
+    Build paths and edge counts from a stream of dataframe chunks,
+    e.g. pd.read_csv(..., chunksize=...)
+
+    Chunks only need to be ordered by time globally, rows of one user may
+    spread across any number of chunks. Only per-user state (last
+    behaviour, path length and seen behaviours) is carried between chunks.
+
+    Edges are kept in the order extract_paths would first meet them, i.e.
+    by user id then position in the path, so that ties at the max_edges
+    cut of the graph are broken the same way.
+
+    :param: keep_paths [bool] Keep the path of each user, otherwise only
+        edges are counted
+    """
+
+    def __init__(self, id_col, behaviour_col, ts_col, keep_paths=True):
+        self.id_col = id_col
+        self.behaviour_col = behaviour_col
+        self.ts_col = ts_col
+        self.keep_paths = keep_paths
+        self.row_count = 0
+
+        self._codes = {START: START_CODE, EXIT: EXIT_CODE}
+        self._labels = [START, EXIT]
+        self._users = {}
+        self._user_ids = []
+        self._last = np.empty(0, dtype=np.int32)
+        self._length = np.empty(0, dtype=np.int64)
+        self._seen = set()
+        self._paths = []
+        self._edge_count = Counter()
+        # (user id, position in path) of the first occurence of each edge
+        self._edge_first = {}
+
+    @staticmethod
+    def _intern(values, index, labels):
+        for v in pd.unique(values):
+            if v not in index:
+                index[v] = len(labels)
+                labels.append(v)
+        return pd.Series(values).map(index).values
+
+    def add_chunk(self, chunk):
+        self.row_count += len(chunk)
+        chunk = chunk[chunk[self.id_col].notnull()]
+        if not len(chunk):
+            return
+
+        user_count = len(self._user_ids)
+        uid = self._intern(chunk[self.id_col].values,
+                           self._users, self._user_ids)
+        if len(self._user_ids) > user_count:
+            new_last = np.empty(len(self._user_ids), dtype=np.int32)
+            new_last[:user_count] = self._last
+            new_last[user_count:] = START_CODE
+            self._last = new_last
+            self._length = np.concatenate([
+                self._length,
+                np.zeros(len(self._user_ids) - user_count, dtype=np.int64)])
+            if self.keep_paths:
+                self._paths.extend(
+                    [] for _ in range(len(self._user_ids) - user_count))
+
+        node = clean_behaviour(chunk[self.behaviour_col]).values
+        valid = pd.notnull(node)
+        if not valid.any():
+            return
+        frame = pd.DataFrame({
+            'uid': uid[valid],
+            'id': chunk[self.id_col].values[valid],
+            'ts': chunk[self.ts_col].values[valid],
+            'code': self._intern(node[valid], self._codes, self._labels),
+        })
+        frame = frame.sort_values(['uid', 'ts'], kind='mergesort')
+        frame = frame.drop_duplicates(['uid', 'code'], keep='first')
+
+        # drop behaviours the user has done in earlier chunks
+        keys = (frame['uid'].values.astype(np.int64) << 32) + \
+            frame['code'].values
+        seen = self._seen
+        is_new = np.fromiter((k not in seen for k in keys.tolist()),
+                             dtype=bool, count=len(keys))
+        seen.update(keys.tolist())
+        frame = frame[is_new]
+        if not len(frame):
+            return
+
+        uid = frame['uid'].values
+        code = frame['code'].values.astype(np.int32)
+        first = np.ones(len(uid), dtype=bool)
+        first[1:] = uid[1:] != uid[:-1]
+        last = np.ones(len(uid), dtype=bool)
+        last[:-1] = first[1:]
+
+        src = np.empty(len(code), dtype=np.int32)
+        src[1:] = code[:-1]
+        src[first] = self._last[uid[first]]
+        self._last[uid[last]] = code[last]
+
+        # position of src in the path, start being 0
+        group_start = np.flatnonzero(first)
+        pos = self._length[uid] + np.arange(len(uid)) - \
+            group_start[np.cumsum(first) - 1]
+        self._length += np.bincount(uid, minlength=len(self._length))
+
+        pair = (src.astype(np.int64) << 32) + code
+        pairs, counts = np.unique(pair, return_counts=True)
+        for key, count in zip(pairs.tolist(), counts.tolist()):
+            self._edge_count[(key >> 32, key & 0xffffffff)] += count
+
+        occurences = pd.DataFrame({
+            'pair': pair,
+            'id': frame['id'].values,
+            'pos': pos,
+        }).sort_values(['id', 'pos'], kind='mergesort')
+        occurences = occurences.drop_duplicates('pair', keep='first')
+        edge_first = self._edge_first
+        for key, user_id, p in zip(occurences['pair'].tolist(),
+                                   occurences['id'].tolist(),
+                                   occurences['pos'].tolist()):
+            edge = (key >> 32, key & 0xffffffff)
+            if edge not in edge_first or (user_id, p) < edge_first[edge]:
+                edge_first[edge] = (user_id, p)
+
+        if self.keep_paths:
+            bounds = np.flatnonzero(first).tolist() + [len(uid)]
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                self._paths[uid[start]].extend(code[start:end].tolist())
+
+    def finish(self, node_mapping=None):
+        """
+        Close every user path with an exit edge
+
+        :return: (PathStore or None, EdgeTable)
+        """
+        vocab = np.asarray(self._labels, dtype=object)
+        # same user order as groupby
+        user_ids = pd.Index(self._user_ids)
+        order = np.argsort(user_ids.values, kind='mergesort')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+
+        edge_count = self._edge_count.copy()
+        first_rank = {}
+        first_pos = {}
+        for edge, (user_id, p) in self._edge_first.items():
+            first_rank[edge] = rank[self._users[user_id]]
+            first_pos[edge] = p
+        # exit edge of every user, first met on the user of lowest rank
+        by_rank = np.argsort(rank, kind='mergesort')
+        exit_src, exit_idx, exit_counts = np.unique(
+            self._last[by_rank], return_index=True, return_counts=True)
+        for src, i, count in zip(exit_src.tolist(),
+                                 by_rank[exit_idx].tolist(),
+                                 exit_counts.tolist()):
+            edge_count[(src, EXIT_CODE)] += count
+            first_rank[(src, EXIT_CODE)] = rank[i]
+            first_pos[(src, EXIT_CODE)] = self._length[i]
+
+        edges_first = list(edge_count)
+        edge_order = np.lexsort((
+            np.array([first_pos[e] for e in edges_first], dtype=np.int64),
+            np.array([first_rank[e] for e in edges_first], dtype=np.int64)))
+        edges_first = [edges_first[i] for i in edge_order]
+        edge_src = np.array([e[0] for e in edges_first], dtype=np.int32)
+        edge_dst = np.array([e[1] for e in edges_first], dtype=np.int32)
+        counts = np.array([edge_count[e] for e in edges_first],
+                          dtype=np.int64)
+        edge_vocab = vocab
+        if node_mapping:
+            code_mapping, edge_vocab = map_vocab(vocab, node_mapping)
+            edge_src = code_mapping[edge_src]
+            edge_dst = code_mapping[edge_dst]
+        edges = EdgeTable.from_codes(edge_src, edge_dst, edge_vocab,
+                                     counts=counts)
+
+        paths = None
+        if self.keep_paths:
+            path_list = [self._paths[i] for i in order]
+            lengths = np.array([len(p) + 2 for p in path_list],
+                               dtype=np.int64)
+            offsets = np.zeros(len(path_list) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            codes = np.empty(offsets[-1], dtype=np.int32)
+            codes[offsets[:-1]] = START_CODE
+            codes[offsets[1:] - 1] = EXIT_CODE
+            interior = np.ones(offsets[-1], dtype=bool)
+            interior[offsets[:-1]] = False
+            interior[offsets[1:] - 1] = False
+            codes[interior] = [c for p in path_list for c in p]
+            paths = PathStore(user_ids[order], offsets, codes, vocab)
+        return paths, edges
+
+
+def _extract_shard(args):
+    return extract_paths(*args)
+
+
+def extract_paths_parallel(df, id_col, behaviour_col, ts_col, workers=2):
+    """
+    Same as extract_paths, with users hash-partitioned by `id_col` across
+    a pool of `workers` processes
+    """
+    frame = df[[id_col, behaviour_col, ts_col]]
+    shard = pd.util.hash_pandas_object(
+        frame[id_col], index=False).values % workers
+    shards = [
+        (frame[shard == i], id_col, behaviour_col, ts_col)
+        for i in range(workers)
+    ]
+    pool = Pool(workers)
+    try:
+        stores = pool.map(_extract_shard, shards)
+    finally:
+        pool.close()
+        pool.join()
+    return merge_paths(stores)
+
+
+def user_hash(ids, seed=0):
+    """
+    Hash of each user id, stable across runs and machines for a given seed
+
+    :param: seed [int] 0 <= seed < 10 ** 16, the 16 digits of the hash key
+    :return: uint64 array
+    """
+    if not isinstance(seed, numbers.Integral) or isinstance(seed, bool) or \
+            not 0 <= seed < 10 ** 16:
+        raise ValueError(
+            "seed must be an integer in [0, 10 ** 16), got {!r}".format(seed))
+    return pd.util.hash_pandas_object(
+        pd.Series(np.asarray(ids)), index=False,
+        hash_key='{:016d}'.format(seed)).values
+
+
+def hash_sample(ids, fraction, seed=0):
+    """
+    Keep about `fraction` of users, decided from each id alone so the same
+    users are kept from every chunk of a log
+
+    :param: fraction - 0 < fraction <= 1
+    :return: boolean array
+    """
+    if not isinstance(fraction, numbers.Real) or \
+            not 0 < fraction <= 1:
+        raise ValueError(
+            "fraction must be in (0, 1], got {!r}".format(fraction))
+    h = user_hash(ids, seed=seed)
+    if fraction == 1:
+        # largest hashes round up to 1.0
+        return np.ones(len(h), dtype=bool)
+    return h / float(1 << 64) < fraction
+
+
+def merge_paths(stores):
+    """
+    Merge PathStores of disjoint users into one, users in sorted order
+    """
+    # shared vocabulary, start / exit keep their codes
+    codes, vocab = pd.factorize(
+        np.concatenate([[START, EXIT]] + [s.vocab for s in stores]))
+    code_mappings = np.split(codes[2:].astype(np.int32),
+                             np.cumsum([len(s.vocab) for s in stores])[:-1])
+    all_codes = np.concatenate([
+        mapping[s.codes] for s, mapping in zip(stores, code_mappings)
+    ])
+    starts = np.concatenate([
+        s.offsets[:-1] + base for s, base in zip(
+            stores, np.cumsum([0] + [len(s.codes) for s in stores[:-1]]))
+    ])
+    lengths = np.concatenate([s.lengths() for s in stores])
+    user_ids = np.concatenate([np.asarray(s.user_ids) for s in stores])
+
+    order = np.argsort(user_ids, kind='mergesort')
+    lengths = lengths[order]
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    gather = np.repeat(starts[order] - offsets[:-1], lengths) + \
+        np.arange(offsets[-1])
+    return PathStore(pd.Index(user_ids[order]), offsets, all_codes[gather],
+                     np.asarray(vocab, dtype=object))
+
+
+def common_prefix_lengths(paths, funnel_path):
+    """
+    Number of leading funnel steps each user path contains in order,
+    i.e. length of Funnel.is_common_path for every user at once
+
+    :return: int array, one per user of paths
+    """
+    return funnel_steps_matrix(paths, [funnel_path])[:, 0]
+
+
+def funnel_steps_matrix(paths, funnel_paths):
+    """
+    Common prefix length of every user path with every funnel path
+
+    Funnel paths are merged into a prefix trie, so shared leading steps are
+    matched once, and user paths are scanned once for all funnel steps.
+
+    :return: int array of shape (users, funnels)
+    """
+    user_count = len(paths)
+    code_of = {label: code for code, label in enumerate(paths.vocab)}
+
+    # trie of funnel steps, node 0 is the root
+    trie = {}
+    parent = [0]
+    node_code = [-1]
+    funnel_node = []
+    for funnel_path in funnel_paths:
+        node = 0
+        for s in funnel_path:
+            key = (node, s)
+            if key not in trie:
+                trie[key] = len(parent)
+                parent.append(node)
+                node_code.append(code_of.get(s, -1))
+            node = trie[key]
+        funnel_node.append(node)
+
+    # first position of every funnel step in every user path, as hits
+    # sorted by (step, user) so that each step is a slice
+    step_codes = np.unique([c for c in node_code[1:] if c >= 0])
+    hit = np.flatnonzero(np.isin(paths.codes, step_codes))
+    rows = np.searchsorted(paths.offsets, hit, side='right') - 1
+    code_idx = np.searchsorted(step_codes, paths.codes[hit])
+    # first occurence within each path
+    _, first = np.unique(code_idx.astype(np.int64) * user_count + rows,
+                         return_index=True)
+    hit_rows = rows[first]
+    hit_pos = (hit[first] - paths.offsets[hit_rows]).astype(np.int32)
+    bounds = np.searchsorted(code_idx[first],
+                             np.arange(len(step_codes) + 1))
+    code_row = {c: i for i, c in enumerate(step_codes.tolist())}
+    absent = np.full(user_count, -1, dtype=np.int32)
+
+    def step_pos(c):
+        """ Position of step code c in every user path, -1 if absent
+        """
+        if c < 0:
+            return absent
+        i = code_row[c]
+        node_pos = absent.copy()
+        node_pos[hit_rows[bounds[i]:bounds[i + 1]]] = \
+            hit_pos[bounds[i]:bounds[i + 1]]
+        return node_pos
+
+    children = [[] for _ in parent]
+    for node in range(1, len(parent)):
+        children[parent[node]].append(node)
+    funnels_at = [[] for _ in parent]
+    for f, node in enumerate(funnel_node):
+        funnels_at[node].append(f)
+
+    # paths are de-duplicated, so greedy matching only needs each step to
+    # come after the previous one. Depth first, so that only the counts of
+    # the nodes on the way from the root are kept.
+    matrix = np.zeros((user_count, len(funnel_paths)), dtype=np.int32)
+    stack = [(0, 0, None, None)]
+    while stack:
+        node, depth, parent_count, parent_pos = stack.pop()
+        if node == 0:
+            count = np.zeros(user_count, dtype=np.int32)
+            pos = absent
+        else:
+            pos = step_pos(node_code[node])
+            matched = (parent_count == depth - 1) & (pos > parent_pos)
+            count = parent_count + matched
+        for f in funnels_at[node]:
+            matrix[:, f] = count
+        for child in reversed(children[node]):
+            stack.append((child, depth + 1, count, pos))
+    return matrix
+
+
+def match_funnel_steps(uid, behaviour, funnel_path, state):
+    """
+    Greedily match the rows of every user against a funnel, i.e. what
+    walking the rows of each user one at a time would do
+
+    :param: uid - user index of each row, rows ordered by user then time
+    :param: behaviour - behaviour of each row
+    :param: state - steps already matched by each user, updated in place so
+        that consecutive chunks of rows can be matched
+    :return: step reached by each row matching the next step of its user,
+        0 for other rows
+    """
+    step_names = pd.Index(pd.unique(np.asarray(funnel_path, dtype=object)))
+    row_step = step_names.get_indexer(behaviour)
+    step_code = step_names.get_indexer(funnel_path)
+
+    step_count = np.zeros(len(uid), dtype=np.int64)
+    # row of the previous match of each user, within these rows
+    last_row = np.full(len(state), -1, dtype=np.int64)
+    for i, code in enumerate(step_code):
+        rows = np.flatnonzero(row_step == code)
+        users = uid[rows]
+        rows = rows[(state[users] == i) & (rows > last_row[users])]
+        # first candidate row of each user
+        users, first = np.unique(uid[rows], return_index=True)
+        rows = rows[first]
+        step_count[rows] = i + 1
+        state[users] = i + 1
+        last_row[users] = rows
+    return step_count
+
+
+def count_edges(paths, node_mapping=None):
+    """
+    Count consecutive (src, dst) pairs of all paths
+
+    :param: node_mapping dict - a dictionary of {dst : [src]}
+
+    :return: EdgeTable in order of first occurence
+    """
+    src, dst = paths.edge_codes()
+    vocab = paths.vocab
+    if node_mapping:
+        code_mapping, vocab = map_vocab(vocab, node_mapping)
+        src = code_mapping[src]
+        dst = code_mapping[dst]
+    return EdgeTable.from_codes(src, dst, vocab)
+
+
+def map_vocab(vocab, node_mapping):
+    """
+    Map a vocabulary through node_mapping
+
+    :return: (code_mapping, mapped_vocab) - old code i becomes code_mapping[i]
+    """
+    src_dst_mapping = {}
+    for dst, src_list in node_mapping.items():
+        for src in src_list:
+            src_dst_mapping[src] = dst
+    mapped = pd.Series(vocab).map(src_dst_mapping)
+    mapped = np.where(mapped.notnull(), mapped.values, vocab)
+    code_mapping, mapped_vocab = pd.factorize(mapped)
+    return (code_mapping.astype(np.int32),
+            np.asarray(mapped_vocab, dtype=object))
@@ -0,0 +1,159 @@
+"""
+Transition counts between nodes as a sparse matrix
+
+The matrix is the primary store of the graph of a Graphitty, the networkx
+graph is only built when needed e.g. for rendering.
+"""
+import re
+
+import networkx as nx
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+WEIGHT_N = re.compile(r'^weight\d+$')
+
+
+def edge_weight(d, weight='weight'):
+    w = d.get(weight)
+    if w is None:
+        # combined graph keeps the weight of each graph
+        w = sum(v for k, v in d.items() if WEIGHT_N.match(k))
+    return w
+
+
+class TransitionMatrix(object):
+    """
+    Edges (src, dst, count) over `nodes`, in the order they were added
+
+    `counts` is the CSR matrix of counts, row = src and column = dst.
+    """
+
+    def __init__(self, nodes, src, dst, counts):
+        """
+        :param: nodes - node labels, in order of first appearance
+        :param: src, dst - index into nodes of every edge
+        :param: counts - weight of every edge
+        """
+        self.nodes = np.asarray(nodes, dtype=object)
+        self.src = np.asarray(src, dtype=np.int64)
+        self.dst = np.asarray(dst, dtype=np.int64)
+        self.edge_counts = np.asarray(counts)
+        self._index = None
+        self._counts = None
+
+    @classmethod
+    def from_edges(cls, edges, nodes=None):
+        """
+        :param: edges - iterable of ((src, dst), count)
+        :param: nodes - nodes to add before those of the edges
+        """
+        index = {}
+        for n in nodes or []:
+            index.setdefault(n, len(index))
+        src = []
+        dst = []
+        counts = []
+        for (n0, n1), count in edges:
+            src.append(index.setdefault(n0, len(index)))
+            dst.append(index.setdefault(n1, len(index)))
+            counts.append(count)
+        labels = np.empty(len(index), dtype=object)
+        labels[list(index.values())] = list(index.keys())
+        matrix = cls(labels, src, dst, counts)
+        matrix._index = index
+        return matrix
+
+    @classmethod
+    def from_graph(cls, G, weight='weight'):
+        return cls.from_edges(
+            (((n0, n1), edge_weight(d, weight))
+             for n0, n1, d in G.edges(data=True)),
+            nodes=G.nodes())
+
+    def matches_graph(self, G):
+        """ Same nodes and number of edges as G, i.e. G was not edited
+        since the matrix was built from it or G from the matrix
+        """
+        return len(self.nodes) == G.number_of_nodes() and \
+            self.edge_count == G.number_of_edges() and \
+            all(n in G for n in self.nodes.tolist())
+
+    @property
+    def index(self):
+        """ Dict of node label -> row / column
+        """
+        if self._index is None:
+            self._index = {n: i for i, n in enumerate(self.nodes)}
+        return self._index
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def edge_count(self):
+        return len(self.src)
+
+    @property
+    def counts(self):
+        if self._counts is None:
+            n = len(self.nodes)
+            self._counts = sparse.csr_matrix(
+                (self.edge_counts.astype(float), (self.src, self.dst)),
+                shape=(n, n))
+        return self._counts
+
+    @property
+    def out_totals(self):
+        """ Total count out of every node
+        """
+        return np.bincount(self.src, weights=self.edge_counts,
+                           minlength=len(self.nodes))
+
+    @property
+    def in_totals(self):
+        """ Total count into every node
+        """
+        return np.bincount(self.dst, weights=self.edge_counts,
+                           minlength=len(self.nodes))
+
+    def edge_probabilities(self):
+        """ Transition probability of every edge, count over the out total
+        of its src
+        """
+        out_totals = self.out_totals
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(out_totals[self.src] > 0,
+                            self.edge_counts / out_totals[self.src], 0.)
+
+    @property
+    def probabilities(self):
+        """ Row normalised CSR matrix of transition probabilities
+        """
+        out_totals = self.out_totals
+        scale = np.zeros(len(self.nodes))
+        nonzero = out_totals > 0
+        scale[nonzero] = 1. / out_totals[nonzero]
+        return sparse.diags(scale).dot(self.counts).tocsr()
+
+    def strongly_connected_components(self):
+        """
+        :return: list of sets of node labels
+        """
+        count, labels = csgraph.connected_components(
+            self.counts, directed=True, connection='strong')
+        components = [set() for _ in range(count)]
+        for node, label in zip(self.nodes.tolist(), labels.tolist()):
+            components[label].add(node)
+        return components
+
+    def to_networkx(self, weight='weight'):
+        G = nx.DiGraph()
+        G.add_nodes_from(self.nodes.tolist())
+        nodes = self.nodes
+        G.add_edges_from(
+            (n0, n1, {weight: count})
+            for n0, n1, count in zip(nodes[self.src].tolist(),
+                                     nodes[self.dst].tolist(),
+                                     self.edge_counts.tolist()))
+        return G
@@ -4,23 +4,45 @@
 Script for consuming given file into output image
 
 graphitty_csv csv1 csv1 combine_output.png
+
+Set GRAPHITTY_CACHE_DIR to cache built graphs between runs, and
+GRAPHITTY_CHUNKSIZE to stream the csv files in chunks of that many rows
+instead of loading them at once (rows must be sorted by date).
 """
+import os
 import sys
 
 import pandas as pd
 from graphitty.graphitty import Graphitty
 from graphitty.combiner import GraphCombiner
-from nxpd import draw
+from graphitty.cache import GraphCache
 
 
-def parse_graph(csv):
+def parse_graph(csv, chunksize=None, cache=None):
+    """
+    :param: chunksize [int] Stream the csv in chunks of rows instead of
+        loading it at once, rows must be sorted by date
+    :param: cache [GraphCache] Reuse graph built before from the same file
+    """
     output_png = csv + '.png'
-    df = pd.read_csv(csv)
-    g = Graphitty(
-        df,
-        id_col='ip',
-        beahivour_col='url',
-        ts_col='date')
+    fingerprint = GraphCache.fingerprint_file(csv) if cache else None
+    if chunksize:
+        g = Graphitty.from_chunks(
+            pd.read_csv(csv, chunksize=chunksize),
+            id_col='ip',
+            behaviour_col='url',
+            ts_col='date',
+            cache=cache,
+            fingerprint=fingerprint)
+    else:
+        df = pd.read_csv(csv)
+        g = Graphitty(
+            df,
+            id_col='ip',
+            behaviour_col='url',
+            ts_col='date',
+            cache=cache,
+            fingerprint=fingerprint)
 
     # draw non-condensed version
     nx_orig = g.render_graph(
@@ -38,15 +60,20 @@ def parse_graph(csv):
 
 
 def draw_with_output(g, f):
-    print "Drawing: {}".format(f)
+    from nxpd import draw
+
+    print("Drawing: {}".format(f))
     draw(g, f, show=False)
 
 if __name__ == '__main__':
     csv1 = sys.argv[1]
     csv2 = sys.argv[2]
     imgout = sys.argv[3]
-    g1 = parse_graph(csv1)
-    g2 = parse_graph(csv2)
+    cache_dir = os.environ.get('GRAPHITTY_CACHE_DIR')
+    cache = GraphCache(cache_dir) if cache_dir else None
+    chunksize = int(os.environ.get('GRAPHITTY_CHUNKSIZE') or 0) or None
+    g1 = parse_graph(csv1, chunksize=chunksize, cache=cache)
+    g2 = parse_graph(csv2, chunksize=chunksize, cache=cache)
 
     g = GraphCombiner(g1, g2)
     simplified_g = g.get_simplifed_combine_graph()
@@ -31,7 +31,7 @@ def g():
     g = Graphitty(
         df,
         id_col='ip',
-        beahivour_col='url',
+        behaviour_col='url',
         ts_col='date')
     return g
 
@@ -42,6 +42,6 @@ def g2():
     g = Graphitty(
         df,
         id_col='ip',
-        beahivour_col='url',
+        behaviour_col='url',
         ts_col='date')
     return g
@@ -0,0 +1,46 @@
+"""
+Smoke test the benchmark harness at a tiny scale
+"""
+import pytest
+
+from benchmarks.clickstream import generate_clickstream
+from benchmarks.stages import (
+    STAGES, compare_reports, measure, run_stages, scaling)
+
+
+def test_generate_clickstream():
+    df = generate_clickstream(users=50, events_per_user=4, vocab_size=20,
+                              seed=3)
+    assert list(df.columns) == ['ip', 'date', 'url']
+    assert df.ip.nunique() == 50
+    assert df.url.nunique() <= 20
+    assert df.date.is_monotonic_increasing
+    assert df.equals(generate_clickstream(
+        users=50, events_per_user=4, vocab_size=20, seed=3))
+
+
+def test_run_stages():
+    results = run_stages(100) + run_stages(200)
+    assert [r['stage'] for r in results] == STAGES * 2
+    assert set(scaling(results)) <= set(STAGES)
+
+    report = {'results': results}
+    baseline = {'results': [dict(r, seconds=r['seconds'] / 10.)
+                            for r in results]}
+    assert len(compare_reports(report, report)) == 0
+    assert len(compare_reports(report, baseline)) > 0
+
+
+def test_measure_times_untraced_run():
+    tracemalloc = pytest.importorskip('tracemalloc')
+    calls = []
+
+    def func():
+        calls.append(tracemalloc.is_tracing())
+        return [0] * 1000
+
+    result, seconds, peak = measure(func)
+    assert len(result) == 1000
+    assert calls == [False, True]
+    assert peak > 0
+    assert measure(func, memory=False)[2] is None
@@ -0,0 +1,74 @@
+"""
+Test caching built graphs on disk
+"""
+import os
+
+import pandas as pd
+
+from graphitty.cache import GraphCache
+from graphitty.graphitty import Graphitty
+from .conftest import FIXTURE
+
+
+def build(df, cache, **kwargs):
+    return Graphitty(
+        df,
+        id_col='ip',
+        behaviour_col='url',
+        ts_col='date',
+        cache=cache,
+        **kwargs)
+
+
+def test_cache_hit(tmpdir):
+    cache = GraphCache(str(tmpdir))
+    df = pd.read_csv(FIXTURE)
+    g = build(df, cache)
+    mapping = g.get_simplify_mapping()
+    assert len(os.listdir(str(tmpdir))) == 1
+
+    g_cached = build(df, cache)
+    assert g_cached.cache_key == g.cache_key
+    assert list(g_cached.G.edges(data=True)) == list(g.G.edges(data=True))
+    assert list(g_cached.path_aggregate_df.path) == \
+        list(g.path_aggregate_df.path)
+    assert g_cached.get_simplify_mapping() == mapping
+
+    # different parameter is a different entry
+    g_small = build(df, cache, max_edges=20)
+    assert g_small.cache_key != g.cache_key
+    assert len(g_small.G.edges()) <= 20
+    assert len(os.listdir(str(tmpdir))) == 2
+
+
+def test_cache_after_shorten_name(tmpdir):
+    cache = GraphCache(str(tmpdir))
+    df = pd.read_csv(FIXTURE)
+    build(df, cache).get_simplify_mapping()
+
+    g = build(df, cache)
+    g.shorten_name()
+    assert g.cache is None
+    mapping = g.get_simplify_mapping(shorten=False)
+    assert set().union(*mapping.values()) == set(g.G.nodes())
+    assert 'start' in g.simplify().G.nodes()
+
+
+def test_cache_eviction(tmpdir):
+    cache = GraphCache(str(tmpdir), max_bytes=1)
+    df = pd.read_csv(FIXTURE)
+    build(df, cache)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_cache_chunks(tmpdir):
+    cache = GraphCache(str(tmpdir))
+    fingerprint = GraphCache.fingerprint_file(FIXTURE)
+    g = Graphitty.from_chunks(
+        pd.read_csv(FIXTURE, chunksize=1000),
+        id_col='ip', behaviour_col='url', ts_col='date',
+        cache=cache, fingerprint=fingerprint)
+    g_cached = Graphitty.from_chunks(
+        [], id_col='ip', behaviour_col='url', ts_col='date',
+        cache=cache, fingerprint=fingerprint)
+    assert list(g_cached.G.edges(data=True)) == list(g.G.edges(data=True))
@@ -1,12 +1,15 @@
 """
 Test function with collapsing multiple graphs
 """
+import copy
 import os
 from itertools import chain
 import networkx as nx
+import numpy as np
 from nxpd import draw
 
 from graphitty.combiner import GraphCombiner
+from graphitty.comparator import Comparator
 
 from .conftest import ARTIFACTS_DIR
 
@@ -43,7 +46,8 @@ def test_name_collapse(g, g2):
     # print "same={}".format(same)
     # print "different={}".format(different)
     assert len(same) >= 3
-    assert 1 <= len(different) <= 20
+    # backref edges no longer use up max_edges, so more nodes are kept
+    assert 1 <= len(different) <= 30
 
 
 def test_simplify_comparison(g, g2):
@@ -63,3 +67,62 @@ def test_simplify_comparison(g, g2):
     # assert len(comparison) > 3
 
     # nx_combined.add_comparison_graph(signficance=0.03)
+
+
+def test_combine_many_graphs(g, g2):
+    edges_before = list(g.G.edges(data=True))
+    combine_g = GraphCombiner(g, g2, g, split_weight=True)
+    assert list(g.G.edges(data=True)) == edges_before
+
+    weights = combine_g.weights
+    assert list(weights.columns) == ['weight1', 'weight2', 'weight3']
+    assert weights.weight1.equals(weights.weight3)
+    for i, graph in enumerate([g, g2]):
+        column = weights.iloc[:, i]
+        assert column.sum() == sum(
+            w for _, _, w in graph.G.edges(data='weight'))
+        for n1, n2, w in graph.G.edges(data='weight'):
+            assert column[(n1, n2)] == w
+            assert combine_g.G[n1][n2]['weight{}'.format(i + 1)] == w
+
+    total_g = GraphCombiner(g, g2, g)
+    for (n1, n2), row in weights.iterrows():
+        assert total_g.G[n1][n2]['weight'] == row.sum()
+
+
+def test_simplify_comparison_from_edge_counts(g, g2):
+    simplified_g = GraphCombiner(g, g2).get_simplifed_combine_graph()
+
+    def edges_only(graph):
+        # as built by from_chunks(..., keep_paths=False)
+        graph = copy.copy(graph)
+        graph.df = None
+        graph.paths = None
+        return graph
+
+    g_edges, g2_edges = edges_only(g), edges_only(g2)
+    assert g_edges.user_count == g.df.ip.nunique()
+    assert g2_edges.user_count == g2.df.ip.nunique()
+    # exit is mapped to '[1] exit'
+    g_remap = edges_only(g.remap(g.get_simplify_mapping(shorten=False)))
+    assert g_remap.user_count == g.df.ip.nunique()
+
+    simplified_edges = GraphCombiner(
+        g_edges, g2_edges).get_simplifed_combine_graph()
+    assert list(simplified_edges.G.edges(data=True)) == \
+        list(simplified_g.G.edges(data=True))
+
+
+def test_compare_edges(g, g2):
+    combine_g = GraphCombiner(g, g2, split_weight=True)
+    combine_g.do_compare()
+    comparison = combine_g.comparison
+    assert comparison.index.equals(combine_g.weights.index)
+    for (n1, n2), row in comparison.iterrows():
+        eattr = combine_g.G[n1][n2]
+        assert np.isclose(row['compare'], Comparator.compare_value(
+            eattr.get('weight1', 0), eattr.get('weight2', 0),
+            total1=g.df.ip.nunique(), total2=g2.df.ip.nunique()))
+        assert eattr['comparison'] == row['compare']
+        assert eattr['p_value'] == row.p_value
+        assert row.ci_low <= row['compare'] <= row.ci_high
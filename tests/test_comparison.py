@@ -1,7 +1,9 @@
 """
 This is responsible for doing comparison for a simple list
 """
+import math
 
+import numpy as np
 import pandas as pd
 from graphitty.comparator import Comparator
 
@@ -43,3 +45,31 @@ def test_compare_list():
     )
 
     assert len(comparator_list) > 2
+
+    assert (comparator_list['compare'].abs() > 0.20).all()
+    assert comparator_list['compare'].abs().is_monotonic_decreasing
+    assert len(Comparator.compare_list(
+        l1, l2, total1=t1, total2=t2, threshold=0)) == 14
+
+
+def test_compare_significance():
+    v1 = np.array([120, 50, 0])
+    v2 = np.array([100, 50, 30])
+    significance = Comparator.compare_significance(
+        v1, v2, total1=1000, total2=1200)
+
+    assert np.allclose(significance['compare'],
+                       Comparator.compare_value(v1, v2, 1000, 1200))
+    for i in range(len(v1)):
+        p1, p2 = v1[i] / 1000., v2[i] / 1200.
+        pooled = (v1[i] + v2[i]) / 2200.
+        z = (p1 - p2) / np.sqrt(pooled * (1 - pooled) * (1 / 1000. +
+                                                         1 / 1200.))
+        row = significance.iloc[i]
+        assert np.isclose(row.z, z)
+        assert np.isclose(row.p_value, math.erfc(abs(z) / math.sqrt(2)))
+        margin = 1.959964 * np.sqrt(p1 * (1 - p1) / 1000. +
+                                    p2 * (1 - p2) / 1200.)
+        assert np.isclose(row.ci_low, p1 - p2 - margin)
+        assert np.isclose(row.ci_high, p1 - p2 + margin)
+    assert significance.p_value[2] < 0.001 < significance.p_value[0]
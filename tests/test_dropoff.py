@@ -0,0 +1,64 @@
+"""
+Test dropoff statistics against computing them one step at a time
+"""
+import numpy as np
+import pandas as pd
+
+from graphitty.dropoff import DropoffStats
+from graphitty.funnel import Funnel
+
+
+def annotated_funnel(g):
+    f = Funnel(['start', '/ksc.html', '/shuttle/missions/missions.html',
+                '/shuttle/countdown/liftoff.html', 'exit'], g)
+    df = f.extract_key_steps_from_df()
+    df['hour'] = pd.to_datetime(df['date']).dt.hour
+    df.loc[df.index[::7], 'hour'] = np.nan
+    return f
+
+
+def test_histogram_matches_numpy(g):
+    f = annotated_funnel(g)
+    df = f.annotated_df
+    for xmax in [None, 12]:
+        counts, bin_edges = f.dropoff_stats.histogram(
+            'hour', bins=6, xmax=xmax)
+        for step, step_df in df.groupby('step_count'):
+            step_xmax = step_df.hour.max() if xmax is None else xmax
+            for label, label_df in step_df.groupby('is_last_step'):
+                expected, edges = np.histogram(
+                    label_df.hour.dropna(), bins=6, range=[0, step_xmax])
+                assert counts.loc[(step, label)].tolist() == \
+                    expected.tolist()
+                assert np.allclose(bin_edges.loc[step], edges)
+    assert f.dropoff_stats.histogram('hour', bins=6) is \
+        f.dropoff_stats.histogram('hour', bins=6)
+
+
+def test_quantiles_and_correlation(g):
+    f = annotated_funnel(g)
+    df = f.annotated_df
+    quantiles = f.dropoff_stats.quantiles('hour', q=[.5])
+    correlation = f.dropoff_stats.correlation('hour')
+    for step, step_df in df.groupby('step_count'):
+        for label, label_df in step_df.groupby('is_last_step'):
+            assert quantiles.loc[(step, label), .5] == \
+                label_df.hour.median()
+        step_df = step_df.dropna(subset=['hour'])
+        x = step_df.is_last_step.astype(float)
+        assert correlation.loc[step, 'count'] == len(step_df)
+        if x.nunique() > 1:
+            assert np.isclose(correlation.loc[step, 'correlation'],
+                              np.corrcoef(x, step_df.hour)[0, 1])
+            slope, intercept = np.polyfit(x, step_df.hour, 1)
+            assert np.isclose(correlation.loc[step, 'slope'], slope)
+            assert np.isclose(correlation.loc[step, 'intercept'], intercept)
+
+
+def test_stats_follow_annotated_df(g):
+    f = annotated_funnel(g)
+    stats = f.dropoff_stats
+    assert f.dropoff_stats is stats
+    f.extract_key_steps_from_df()
+    assert f.dropoff_stats is not stats
+    assert isinstance(f.dropoff_stats, DropoffStats)
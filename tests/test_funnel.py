@@ -0,0 +1,155 @@
+"""
+Test simulating funnels over user paths
+"""
+import pandas as pd
+import pytest
+
+from graphitty.funnel import Funnel, FunnelCombination, build_funnels
+from graphitty.graphitty import Graphitty
+from .test_paths import read_timed_fixture
+
+
+def top_paths(g, count=5):
+    g.render_graph()
+    return g.get_path_in_weight_order(max_path=count)
+
+
+def test_funnel_steps_match_common_path(g):
+    for path in top_paths(g):
+        f = Funnel(path, g)
+        for user_id, row in g.path_aggregate_df.iterrows():
+            common_path = f.is_common_path(row.path)
+            assert f.user_max_steps[user_id] == len(common_path)
+
+        user_count = [len(s['user']) for s in f.steps]
+        assert user_count[0] == len(g.paths)
+        assert user_count == sorted(user_count, reverse=True)
+
+
+def test_funnel_remove_user(g):
+    f = Funnel(top_paths(g, count=1)[0], g)
+    user_id = f.user_ids[f.steps[1]['user'][0]]
+    before = f.describe_steps().user_count.tolist()
+
+    f.remove_user(user_id)
+    after = f.describe_steps().user_count.tolist()
+    assert before[0] - after[0] == 1
+    assert before[1] - after[1] == 1
+    assert user_id not in f.user_max_steps
+
+
+def test_build_funnels_in_one_pass(g):
+    paths = top_paths(g, count=10)
+    # funnels sharing leading steps, and a step nobody took
+    paths += [paths[0][:2], paths[0][:2] + ['no-such-page']]
+    funnels = build_funnels(paths, g)
+    for path, f in zip(paths, funnels):
+        assert f.funnel_path == path
+        assert f.user_max_steps == Funnel(path, g).user_max_steps
+
+
+def test_funnel_combination_from_paths(g):
+    combination = FunnelCombination.from_paths(top_paths(g), g)
+    for f in combination.funnels:
+        for user, max_steps in f.user_max_steps.items():
+            assert max_steps == combination.user_max_steps[user]
+
+
+def test_funnel_combination_keeps_furthest_funnel(g):
+    paths = top_paths(g, count=10)
+    funnels = build_funnels(paths, g)
+    # a user dropped from one funnel beforehand is not considered in it
+    removed = funnels[0].user_ids[funnels[0].steps[0]['user'][0]]
+    funnels[0].remove_user(removed)
+    expected = [dict(f.user_max_steps) for f in funnels]
+
+    combination = FunnelCombination(funnels)
+    for user, max_steps in combination.user_max_steps.items():
+        assert max_steps == max(
+            e[user] for e in expected if user in e)
+    for f, e in zip(funnels, expected):
+        assert f.user_max_steps == {
+            user: max_steps for user, max_steps in e.items()
+            if max_steps == combination.user_max_steps[user]}
+        assert [len(s['user']) for s in f.steps] == [
+            sum(1 for m in f.user_max_steps.values() if m > i)
+            for i in range(len(f.funnel_path))]
+    assert removed not in funnels[0].user_max_steps
+
+
+def test_empty_funnel_combination():
+    combination = FunnelCombination([])
+    assert combination.user_max_steps == {}
+    assert combination.user_ids == set()
+    assert len(combination.best_funnel) == 0
+
+
+def label_group_walk(f, group):
+    """ Walk the rows of a user one at a time
+    """
+    funnel_path = f.funnel_path_in_df
+    path_idx = 0
+    wanted_steps = []
+    for _, row in group.sort_values(f.ts_col, kind='mergesort').iterrows():
+        path_name = funnel_path[path_idx] if path_idx < len(
+            funnel_path) else 'exit'
+        if path_name == row[f.behaviour_col]:
+            path_idx += 1
+            row['step_count'] = path_idx
+            wanted_steps.append(row)
+    if not wanted_steps:
+        return None
+    return_df = pd.DataFrame(wanted_steps)
+    return_df['is_last_step'] = (return_df['step_count'] == path_idx)
+    return return_df
+
+
+def test_extract_key_steps_matches_group_walk():
+    df = read_timed_fixture()
+    g = Graphitty(df, id_col='ip', behaviour_col='url', ts_col='date')
+    paths = top_paths(g, count=10)
+    # a step repeated later in the funnel
+    paths.append(['start', '/ksc.html', '/shuttle/missions/missions.html',
+                  '/ksc.html', '/shuttle/countdown/liftoff.html', 'exit'])
+    for path in paths:
+        f = Funnel(path, g)
+        expected = pd.concat([
+            label_group_walk(f, group) for _, group in df.groupby('ip')
+        ]).reset_index(drop=True)
+
+        annotated_df = f.extract_key_steps_from_df()
+        assert list(annotated_df.columns) == list(expected.columns)
+        assert annotated_df[['ip', 'url', 'date']].equals(
+            expected[['ip', 'url', 'date']])
+        assert annotated_df.step_count.tolist() == \
+            expected.step_count.tolist()
+        assert annotated_df.is_last_step.tolist() == \
+            expected.is_last_step.tolist()
+
+        chunks = (df.iloc[i:i + 1000] for i in range(0, len(df), 1000))
+        streamed_df = f.extract_key_steps_from_chunks(chunks)
+        assert streamed_df.equals(annotated_df)
+
+
+def test_sample_users_is_deterministic(g):
+    f = Funnel(top_paths(g, count=1)[0], g)
+    users = f.user_ids[f.in_funnel]
+
+    sampled = f.filter_df_by_users(sample=20, seed=1)
+    assert sampled.ip.nunique() == 20
+    assert sampled.equals(f.filter_df_by_users(sample=20, seed=1))
+    assert not sampled.equals(f.filter_df_by_users(sample=20, seed=2))
+
+    mask = f.sample_users(0.1, seed=1)
+    assert 0 < mask.sum() < 0.2 * len(users)
+    chunks = (g.df.iloc[i:i + 1000] for i in range(0, len(g.df), 1000))
+    assert pd.concat(f.filter_chunks_by_users(chunks, sample=0.1, seed=1)) \
+        .equals(f.filter_df_by_users(sample=0.1, seed=1))
+
+    assert f.sample_users(1.0).sum() == len(users)
+    for sample in [1.5, -0.1, len(users) + 1]:
+        with pytest.raises(ValueError):
+            f.sample_users(sample)
+    for seed in [-1, 10 ** 16, 0.5]:
+        with pytest.raises(ValueError):
+            f.sample_users(0.1, seed=seed)
@@ -0,0 +1,22 @@
+"""
+Guard against heavy plotting / drawing imports when importing graphitty,
+see benchmarks/import_time.py for timings
+"""
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.import_time import HEAVY_MODULES, ROOT
+
+
+@pytest.mark.parametrize('module', [
+    'graphitty.graphitty', 'graphitty.funnel', 'graphitty.cache',
+    'graphitty.dropoff',
+])
+def test_import_is_lazy(module):
+    output = subprocess.check_output([
+        sys.executable, '-c',
+        'import sys, {}; print(",".join(m for m in {!r} if m in sys.modules))'
+        .format(module, HEAVY_MODULES)], cwd=ROOT)
+    assert output.decode('utf-8').strip() == ''
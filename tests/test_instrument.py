@@ -0,0 +1,77 @@
+"""
+Test recording the stages of building and analysing graphs
+"""
+import pandas as pd
+
+from graphitty.combiner import GraphCombiner
+from graphitty.funnel import Funnel
+from graphitty.graphitty import Graphitty
+from graphitty.instrument import Instrumentation
+from .conftest import FIXTURE, FIXTURE2
+
+
+def test_graph_stats():
+    calls = []
+    instrumentation = Instrumentation(
+        callbacks=[lambda stage, record: calls.append(stage)], memory=True)
+    df = pd.read_csv(FIXTURE)
+    g = Graphitty(df, id_col='ip', behaviour_col='url', ts_col='date',
+                  max_edges=50, min_edges=2,
+                  instrumentation=instrumentation)
+    assert calls == ['sort', 'extract_paths', 'count_edges', 'create_graph']
+
+    stats = g.stats
+    assert stats['sort']['rows'] == len(df)
+    assert stats['extract_paths']['rows'] == len(df)
+    assert stats['extract_paths']['users'] == df.ip.nunique()
+    assert stats['extract_paths']['peak_bytes'] > 0
+    assert stats['extract_paths']['seconds'] >= 0
+
+    create = stats['create_graph']
+    assert create['edges'] == len(g.edges)
+    assert create['kept_edges'] == g.G.number_of_edges()
+    assert create['edges'] == create['kept_edges'] + \
+        create['dropped_max_edges'] + create['dropped_min_edges'] + \
+        create['dropped_backref']
+    # backref and below min_edges edges do not use up max_edges
+    assert create['kept_edges'] == 50
+    assert create['dropped_min_edges'] == (g.edges.edges['count'] < 2).sum()
+
+    g.render_graph()
+    g_simplify = g.simplify()
+    for name in ['render_label', 'filter_subgraph', 'condensation',
+                 'shorten_name', 'remap', 'remap.create_graph']:
+        assert name in stats
+        assert calls.count(name) == 1
+    # the simplified graph does not replace the records of the build
+    assert stats['create_graph'] is create
+    assert stats['remap.create_graph']['kept_edges'] == \
+        g_simplify.G.number_of_edges()
+    assert [name for name, _ in instrumentation.records] == calls
+
+    f = Funnel(g.get_path_in_weight_order(max_path=1)[0], g)
+    f.extract_key_steps_from_df()
+    assert f.stats is stats
+    assert stats['funnel_steps']['users'] == len(g.paths)
+    assert stats['extract_key_steps']['kept_rows'] == len(f.annotated_df)
+
+
+def test_combine_stats(g):
+    instrumentation = Instrumentation()
+    g2 = Graphitty(pd.read_csv(FIXTURE2), id_col='ip', behaviour_col='url',
+                   ts_col='date')
+    combine_g = GraphCombiner(g, g2, split_weight=True,
+                              instrumentation=instrumentation)
+    combine_g.do_compare()
+    stats = combine_g.stats
+    assert stats['combine_weights']['edges'] == len(combine_g.weights)
+    assert 'do_compare' in stats
+    assert 'peak_bytes' not in stats['do_compare']
+    assert g.stats == {}
+
+    weights = stats['combine_weights']
+    simplified_g = combine_g.get_simplifed_combine_graph()
+    assert stats['combine_weights'] is weights
+    assert stats['simplified_combine.do_compare']['edges'] == \
+        len(simplified_g.weights)
+    assert 'simplified_combine.condensation' in stats
@@ -0,0 +1,89 @@
+"""
+Test the Markov chain solves against dense linear algebra
+"""
+import numpy as np
+import pytest
+
+from graphitty.markov import MarkovChain
+from graphitty.transitions import TransitionMatrix
+
+
+def toy_chain():
+    # b and c loop, d is a dead end, e and f loop without a way out
+    return MarkovChain(TransitionMatrix.from_edges([
+        (('start', 'a'), 6), (('start', 'b'), 2), (('start', 'e'), 2),
+        (('a', 'b'), 3), (('a', 'exit'), 3),
+        (('b', 'c'), 4), (('b', 'd'), 1), (('b', 'exit'), 1),
+        (('c', 'b'), 1), (('c', 'exit'), 1),
+        (('e', 'f'), 1), (('f', 'e'), 1),
+    ]))
+
+
+def test_toy_chain():
+    chain = toy_chain()
+    index = chain.index
+
+    probability = chain.absorption_probabilities('c')
+    # from b: 4/6 to c directly, c never comes back to b before c
+    assert np.isclose(probability[index['b']], 4. / 6)
+    assert np.isclose(probability[index['a']], 0.5 * 4. / 6)
+    assert probability[index['c']] == 1
+    assert probability[index['e']] == 0
+    assert probability[index['exit']] == 0
+
+    steps = chain.expected_steps()
+    assert steps[index['exit']] == 0
+    assert steps[index['d']] == 0
+    assert np.isinf(steps[index['e']])
+    assert np.isinf(steps[index['start']])
+    # b -> c -> b loop: t_b = 1 + 4/6 t_c, t_c = 1 + 1/2 t_b
+    assert np.isclose(steps[index['b']], 2.5)
+    assert np.isclose(steps[index['a']], 1 + 0.5 * 2.5)
+
+    with pytest.raises(ValueError):
+        chain.expected_visits()
+    visits = chain.expected_visits('a')
+    assert visits[index['a']] == 1
+    assert visits[index['start']] == 0
+    assert np.isclose(visits[index['exit']] + visits[index['d']], 1)
+    assert np.isclose(chain.visit_rates('a').sum(), 1)
+
+
+def test_matches_dense_solve(g):
+    chain = g.markov_chain()
+    P = chain.P.toarray()
+    transient = chain.certain & ~chain.absorbing
+    assert transient[chain.source]
+    Q = P[transient][:, transient]
+    fundamental = np.linalg.inv(np.eye(len(Q)) - Q)
+
+    steps = chain.expected_steps()
+    assert np.allclose(steps[transient], fundamental.sum(axis=1))
+
+    source = np.flatnonzero(transient).tolist().index(chain.source)
+    visits = chain.expected_visits()
+    assert np.allclose(visits[transient], fundamental[source])
+    # every user leaves once
+    assert np.isclose(visits[chain.absorbing].sum(), 1)
+    assert np.isclose(chain.visit_rates().sum(), 1)
+
+    # absorbing in exit equals 1 when leaving is certain
+    exit_probability = chain.absorption_probabilities('exit')
+    leave = chain.absorption_probabilities(
+        chain.nodes[chain.absorbing].tolist())
+    assert np.allclose(leave[chain.certain], 1)
+    assert np.all(exit_probability <= leave + 1e-9)
+
+    target = g.get_path_in_weight_order(g.G, max_path=1)[0][2]
+    is_target = chain.nodes == target
+    rest = ~is_target & ~chain.absorbing
+    Q = P[rest][:, rest]
+    b = P[rest][:, is_target].sum(axis=1)
+    expected = np.linalg.lstsq(np.eye(len(Q)) - Q, b, rcond=None)[0]
+    probability = chain.absorption_probabilities(target)
+    assert np.allclose(probability[rest], expected)
+
+    df = chain.to_frame(target)
+    assert df.loc[target, 'probability'] == 1
+    assert np.isclose(df.loc['start', 'expected_steps'],
+                      steps[chain.source])
@@ -0,0 +1,206 @@
+"""
+Test the batched path extraction against walking each user group
+"""
+import numpy as np
+import pandas as pd
+
+from graphitty.graphitty import Graphitty
+from graphitty.paths import top_order
+from .conftest import FIXTURE
+
+
+class GroupWalkGraphitty(Graphitty):
+    """ Overriding get_template_path falls back to walking each group
+    """
+
+    def get_template_path(self, *args, **kwargs):
+        return Graphitty.get_template_path(self, *args, **kwargs)
+
+
+def read_dirty_fixture():
+    df = pd.read_csv(FIXTURE)
+    df.loc[df.index[::50], 'url'] = np.nan
+    padded = df.index[::37]
+    df.loc[padded, 'url'] = ' ' + df.loc[padded, 'url'].astype(str) + ' '
+    return df
+
+
+def assert_same_paths(g1, g2):
+    assert g1.path_aggregate_df.index.equals(g2.path_aggregate_df.index)
+    assert list(g1.path_aggregate_df.path) == list(g2.path_aggregate_df.path)
+
+
+def assert_same_graph(g1, g2):
+    assert list(g1.G.edges(data=True)) == list(g2.G.edges(data=True))
+    assert_same_paths(g1, g2)
+
+
+def test_batched_path_matches_group_walk():
+    df = read_dirty_fixture()
+    params = dict(id_col='ip', behaviour_col='url', ts_col='date')
+    assert_same_graph(
+        GroupWalkGraphitty(df, **params),
+        Graphitty(df, **params))
+
+
+def test_batched_path_matches_group_walk_with_mapping():
+    df = read_dirty_fixture()
+    params = dict(id_col='ip', behaviour_col='url', ts_col='date',
+                  node_mapping={'ksc': ['/ksc.html', '/history/history.html']})
+    assert_same_graph(
+        GroupWalkGraphitty(df, **params),
+        Graphitty(df, **params))
+
+
+def test_compact_storage(g):
+    assert g.paths.codes.dtype == np.int32
+    assert len(g.paths.offsets) == len(g.paths) + 1
+    assert g.paths.path(0) == g.path_aggregate_df.path.iloc[0]
+
+    edge_count = g.edge_count
+    assert sum(edge_count.values()) == g.edges.edges['count'].sum()
+    for (src, dst), count in g.edges.most_common(10):
+        assert edge_count[(src, dst)] == count
+    # every user path ends with one exit edge
+    assert sum(c for (_, dst), c in edge_count.items()
+               if dst == 'exit') == len(g.paths)
+
+
+def test_path_aggregate_df(g):
+    df = g.build_path()
+    assert isinstance(df, pd.DataFrame)
+    assert g.path_aggregate_df is df
+    assert list(df.path.iloc[0][:1]) == ['start']
+
+    g.path_aggregate_df = df.iloc[:10]
+    assert len(g.paths) == 10
+    assert g.paths.path(3) == df.path.iloc[3]
+    assert g.path_aggregate_df.index.equals(df.index[:10])
+
+
+def test_streaming_matches_batch(g):
+    df = pd.read_csv(FIXTURE).sort_values('date', kind='mergesort')
+    chunks = (df.iloc[i:i + 997] for i in range(0, len(df), 997))
+    g_stream = Graphitty.from_chunks(
+        chunks, id_col='ip', behaviour_col='url', ts_col='date')
+
+    assert g_stream.df is None
+    assert dict(g_stream.edge_count) == dict(g.edge_count)
+    assert list(g_stream.G.edges(data=True)) == list(g.G.edges(data=True))
+    assert g_stream.path_aggregate_df.index.equals(g.path_aggregate_df.index)
+    assert list(g_stream.path_aggregate_df.path) == \
+        list(g.path_aggregate_df.path)
+
+    g_simplify = g_stream.simplify()
+    assert 'start' in g_simplify.G.nodes()
+
+
+def test_streaming_without_paths(g):
+    df = pd.read_csv(FIXTURE).sort_values('date', kind='mergesort')
+    g_stream = Graphitty.from_chunks(
+        (df.iloc[i:i + 500] for i in range(0, len(df), 500)),
+        id_col='ip', behaviour_col='url', ts_col='date',
+        keep_paths=False)
+    assert g_stream.path_aggregate_df is None
+    assert dict(g_stream.edge_count) == dict(g.edge_count)
+    assert list(g_stream.G.edges(data=True)) == list(g.G.edges(data=True))
+
+
+def test_parallel_matches_serial():
+    df = read_dirty_fixture()
+    params = dict(id_col='ip', behaviour_col='url', ts_col='date')
+    assert_same_graph(
+        Graphitty(df, **params),
+        Graphitty(df, workers=3, **params))
+
+
+def test_remap_matches_node_mapping_build(g):
+    mapping = g.get_simplify_mapping()
+    g_remap = g.remap(mapping)
+    g_build = Graphitty(g.df, id_col='ip', behaviour_col='url',
+                        ts_col='date', node_mapping=mapping)
+    assert_same_graph(g_remap, g_build)
+    assert g_remap.paths is g.paths
+
+
+def read_timed_fixture():
+    df = pd.read_csv(FIXTURE)
+    df['date'] = pd.to_datetime(df['date'])
+    # same second events of a user would be ordered by arrival
+    return df.sort_values('date', kind='mergesort').drop_duplicates(
+        ['ip', 'date']).reset_index(drop=True)
+
+
+def test_update_matches_full_build():
+    df = read_timed_fixture()
+    params = dict(id_col='ip', behaviour_col='url', ts_col='date')
+    g_full = Graphitty(df, **params)
+
+    g = Graphitty(df.iloc[:3000], **params)
+    for i in range(3000, len(df), 1000):
+        g.update(df.iloc[i:i + 1000])
+    assert dict(g.edge_count) == dict(g_full.edge_count)
+    assert_same_graph(g, g_full)
+
+
+def test_update_with_late_events():
+    df = read_timed_fixture()
+    params = dict(id_col='ip', behaviour_col='url', ts_col='date')
+    g_full = Graphitty(df, **params)
+
+    g = Graphitty(df.iloc[:3000], **params)
+    late = None
+    for i in range(3000, len(df), 1000):
+        batch = df.iloc[i:i + 1000]
+        # a tenth of the events arrive one batch late, in random order
+        delayed = batch.iloc[::10]
+        batch = pd.concat([batch.drop(delayed.index), late])
+        g.update(batch.sample(frac=1, random_state=i),
+                 window=pd.Timedelta('5D'))
+        late = delayed
+    g.update(late, window=pd.Timedelta('5D'))
+    assert dict(g.edge_count) == dict(g_full.edge_count)
+    assert_same_graph(g, g_full)
+
+
+def test_update_after_rebuild():
+    df = read_timed_fixture()
+    params = dict(id_col='ip', behaviour_col='url', ts_col='date')
+    g = Graphitty(df.iloc[:3000], **params)
+    g.update(df.iloc[3000:4000], window=pd.Timedelta('5D'))
+    g_remap = g.remap({})
+    assert g_remap._pending is g._pending
+
+    # the rebuilt paths have none of the pending events
+    g.build_path()
+    g.update(df.iloc[4000:5000])
+    assert dict(g.edge_count) == dict(
+        Graphitty(pd.concat([df.iloc[:3000], df.iloc[4000:5000]]),
+                  **params).edge_count)
+
+    g_remap.update(df.iloc[4000:], window=pd.Timedelta('5D'))
+    g_remap.update(df.iloc[:0])
+    assert dict(g_remap.edge_count) == dict(
+        Graphitty(df, **params).edge_count)
+
+
+def test_top_order_matches_stable_sort():
+    counts = np.random.RandomState(0).randint(0, 20, size=500)
+    order = np.argsort(-counts, kind='mergesort')
+    for n in [0, 1, 7, 50, 499, 500, 600]:
+        assert top_order(counts, n).tolist() == order[:n].tolist()
+
+
+def test_pruning_fills_max_edges(g):
+    for max_edges, min_edges in [(50, 0), (100, 3), (5000, 2)]:
+        g_pruned = g.remap({}, max_edges=max_edges, min_edges=min_edges)
+        expected = {}
+        for (src, dst), count in g.edges.most_common():
+            if len(expected) >= max_edges:
+                break
+            if count >= min_edges and (dst, src) not in expected:
+                expected[(src, dst)] = count
+        if max_edges < 5000:
+            assert len(expected) == max_edges
+        assert dict(((src, dst), w) for src, dst, w in
+                    g_pruned.G.edges(data='weight')) == expected
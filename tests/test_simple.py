@@ -1,9 +1,10 @@
 import os
+import pytest
 import pandas as pd
 import networkx as nx
 from nxpd import draw
 
-from graphitty.graphitty import Graphitty
+from graphitty.graphitty import Graphitty, NodeIndex
 from .conftest import ARTIFACTS_DIR, FIXTURE
 
 
@@ -52,7 +53,7 @@ def test_simplify_explicit_with_shorten(g):
     g_simplify = Graphitty(
         df,
         id_col='ip',
-        beahivour_col='url',
+        behaviour_col='url',
         ts_col='date',
         node_mapping=mapping)
     assert 'start' in g_simplify.G.nodes()
@@ -74,3 +75,73 @@ def test_simplification(g):
         filter_subgraph=True
     )
     draw(nx_tree, output_png, show=False)
+
+
+def test_path_in_weight_order_on_dense_graph():
+    G = nx.complete_graph(30, create_using=nx.DiGraph())
+    G = nx.relabel_nodes(G, {0: 'start', 29: 'exit'})
+    for i, (n0, n1) in enumerate(G.edges()):
+        G[n0][n1]['weight'] = 1 + i % 7
+    g = Graphitty(None, id_col='ip', behaviour_col='url', ts_col='date',
+                  init=False)
+
+    paths = g.get_path_in_weight_order_with_weight(G, max_path=10)
+    assert len(paths) == 10
+    assert all(p['path'][0] == 'start' and p['path'][-1] == 'exit'
+               for p in paths)
+    probabilities = [p['probability'] for p in paths]
+    assert probabilities == sorted(probabilities, reverse=True)
+    # bounded by default, the dense graph has ~10^30 simple paths
+    assert len(g.get_path_in_weight_order(G)) == 10
+
+
+def test_render_perc_label(g):
+    G = g.render_label(g.G.copy(), use_perc_label=True)
+    # start has no in edge, so its edges are labelled by out weight
+    start_perc = sum(float(d['label'].rstrip('%'))
+                     for _, _, d in G.out_edges('start', data=True))
+    assert abs(start_perc - 100) < 1
+
+    G = g.render_label(G, use_perc_label=False)
+    assert all(d['label'] == d['weight'] for _, _, d in G.edges(data=True))
+
+
+def test_get_node(g):
+    assert g.get_node(g.G, 'start') == 'start'
+    assert g.get_node(g.G, 'exit') == 'exit'
+    assert g.get_node(g.G, '/ksc') == '/ksc.html'
+    with pytest.raises(IndexError):
+        g.get_node(g.G, 'no-such-page')
+
+    mapping = g.get_simplify_mapping(shorten=False)
+    g_simplify = Graphitty(
+        g.df,
+        id_col='ip',
+        behaviour_col='url',
+        ts_col='date',
+        node_mapping=mapping)
+    start = g_simplify.get_node(g_simplify.G, 'start')
+    assert start == '[1] start'
+    assert g_simplify.G.in_degree(start) == 0
+
+    g_simplify.shorten_name()
+    assert g_simplify.get_node(g_simplify.G, 'start') == 'start'
+
+    # relabeled in place with the same number of nodes
+    G = g.G
+    assert g.get_node(G, '/ksc') == '/ksc.html'
+    nx.relabel_nodes(G, {'/ksc.html': '/ksc/index.html'}, copy=False)
+    assert g.get_node(G, '/ksc') == '/ksc/index.html'
+    G.remove_node('/ksc/index.html')
+    G.add_node('/ksc/new.html')
+    assert g.get_node(G, '/ksc') == '/ksc/new.html'
+
+    # graphs other than G are scanned with the same lookup rules
+    H = g_simplify.G.copy()
+    names = [str(n) for n in H.nodes()]
+    for name in ['start', 'exit'] + [n[:3] for n in names] + \
+            [n[2:5] for n in names]:
+        assert g_simplify.get_node(H, name) == \
+            NodeIndex(H).lookup(name)
+    with pytest.raises(IndexError):
+        g.get_node(H, 'no-such-page')
@@ -0,0 +1,65 @@
+"""
+Test the sparse transition matrix against networkx
+"""
+import networkx as nx
+import numpy as np
+
+from graphitty.transitions import TransitionMatrix
+
+
+def test_graph_is_built_on_demand(g):
+    assert g._G is None
+    assert len(g.transitions) == g.G.number_of_nodes()
+    assert g.transitions.edge_count == g.G.number_of_edges()
+
+    # filtering the graph in place is seen by the transitions
+    g.render_graph()
+    assert len(g.transitions) == g.G.number_of_nodes()
+
+
+def test_graph_edited_in_place(g):
+    G = g.G
+    assert len(g.transitions) == G.number_of_nodes()
+    nx.relabel_nodes(G, {'/ksc.html': '/ksc/index.html'}, copy=False)
+    removed = [n for n in G.nodes() if n not in ('start', 'exit')][-1]
+    G.remove_node(removed)
+
+    grouped = set()
+    for nodes in g.get_simplify_mapping(shorten=False).values():
+        grouped.update(nodes)
+    assert grouped == set(G.nodes())
+    assert set(g.markov_chain().nodes) == set(G.nodes())
+    assert 'start' in g.simplify().G.nodes()
+
+
+def test_matches_networkx(g):
+    G = g.G
+    transitions = TransitionMatrix.from_graph(G)
+    assert list(transitions.nodes) == list(G.nodes())
+    assert list(transitions.to_networkx().edges(data=True)) == \
+        list(G.edges(data=True))
+
+    index = transitions.index
+    for n in G.nodes():
+        assert transitions.out_totals[index[n]] == \
+            G.out_degree(n, weight='weight')
+        assert transitions.in_totals[index[n]] == \
+            G.in_degree(n, weight='weight')
+
+    probabilities = transitions.probabilities
+    row_sums = np.asarray(probabilities.sum(axis=1)).ravel()
+    assert np.allclose(row_sums[transitions.out_totals > 0], 1)
+    for n0, n1, w in G.edges(data='weight'):
+        assert np.isclose(probabilities[index[n0], index[n1]],
+                          1. * w / G.out_degree(n0, weight='weight'))
+
+    assert sorted(map(sorted, transitions.strongly_connected_components())) \
+        == sorted(map(sorted, nx.strongly_connected_components(G)))
+
+
+def test_split_weights():
+    G = nx.DiGraph()
+    G.add_edge('a', 'b', weight1=2, weight2=3, weight3=1)
+    G.add_edge('b', 'a', weight2=4)
+    transitions = TransitionMatrix.from_graph(G)
+    assert transitions.edge_counts.tolist() == [6, 4]